@@ -54,6 +54,57 @@ def main():
         action="store_true",
         help="Treat chapters as widestrip images, splitting based on width.",
     )
+    parser.add_argument(
+        "--processes",
+        "-p",
+        type=int,
+        default=1,
+        help="Number of processes used to convert, combine and split the images.",
+    )
+    parser.add_argument(
+        "--encoder-profile",
+        choices=["fast", "balanced", "small"],
+        default="balanced",
+        help="Encoder settings used when images are converted, combined or split.",
+    )
+    parser.add_argument(
+        "--strip-metadata",
+        action="store_true",
+        help="Remove the metadata of JPEG and PNG images without re-encoding them.",
+    )
+    parser.add_argument(
+        "--grayscale",
+        type=int,
+        nargs="?",
+        const=8,
+        default=None,
+        metavar="TOLERANCE",
+        help="Re-encode pages without colour as grayscale. Requires numpy.",
+    )
+    parser.add_argument(
+        "--verify",
+        action="store_true",
+        help="Decode every image before uploading, skipping chapters with corrupt images.",
+    )
+    parser.add_argument(
+        "--isolate",
+        action="store_true",
+        help="Process the images in worker processes that are restarted regularly, for long unattended runs.",
+    )
+    parser.add_argument(
+        "--prefetch",
+        type=int,
+        nargs="?",
+        const=2,
+        default=0,
+        metavar="CHAPTERS",
+        help="Read the next chapters in the background while uploading, for slow or network storage.",
+    )
+    parser.add_argument(
+        "--cache",
+        action="store_true",
+        help="Cache the processed images, so retrying a failed upload doesn't process them again.",
+    )
     parser.add_argument(
         "--dir",
         "-d",
@@ -102,6 +153,7 @@ def main():
         ratelimit_time = config_data["options"]["ratelimit_time"]
         widestrip = vargs.get("widestrip", False)
         combine = vargs.get("combine", False)
+        threaded = vargs.get("threaded", False)
 
         print(f"{'*'*3} {translation.get('accept_terms_conditions','')} {'*'*3}")
         time.sleep(5)
@@ -117,6 +169,11 @@ def main():
             max_log_days=config_data["options"]["max_log_days"],
             group_fallback_id=config_data["options"]["group_fallback_id"],
             number_threads=number_threads,
+            number_processes=vargs.get("processes", 1),
+            encoder_profile=vargs.get("encoder_profile", "balanced"),
+            strip_metadata=vargs.get("strip_metadata", False),
+            grayscale_tolerance=vargs.get("grayscale"),
+            verify_images=vargs.get("verify", False),
             language=config_data["options"]["language"],
             name_id_map_filename=config_data["paths"]["name_id_map_file"],
             uploaded_dir_path=uploaded_files,
@@ -128,6 +185,24 @@ def main():
             move_files=True,
             verbose_level=verbose_level,
             verbose=False,
+            cache_dir_path=(
+                config_data["paths"].get("cache_dir", "cache")
+                if vargs.get("cache", False)
+                else None
+            ),
+            max_cache_size_mb=config_data["options"].get("max_cache_size_mb", 2048),
+            max_batch_size_mb=config_data["options"].get("max_batch_size_mb", 150),
+            max_session_size_mb=config_data["options"].get("max_session_size_mb", 500),
+            max_image_size_mb=config_data["options"].get("max_image_size_mb", 20),
+            memory_budget_mb=config_data["options"].get("memory_budget_mb", 1024),
+            isolate_processing=vargs.get("isolate", False),
+            recycle_workers_chapters=config_data["options"].get(
+                "recycle_workers_chapters", 50
+            ),
+            recycle_workers_mb=config_data["options"].get("recycle_workers_mb", 4096),
+            processing_timeout=config_data["options"].get("processing_timeout", 300),
+            prefetch_chapters=vargs.get("prefetch", 0),
+            prefetch_mb=config_data["options"].get("prefetch_mb", 512),
         )
 
         upload_dir = vargs.get("dir")
@@ -143,6 +218,7 @@ def main():
             upload_directory_path,
             widestrip=widestrip,
             combine=combine,
+            threaded=threaded,
         )
         sys.exit(1 if failed_list else 0)
     except (Exception, MuplException) as e:
@@ -1,7 +1,5 @@
-import asyncio
 import json
 import os
-import time
 import logging
 from pathlib import Path
 from typing import Optional, List, Dict, Tuple, Union
@@ -12,10 +10,19 @@ import natsort
 
 from mupl.file_validator import FileProcesser
 from mupl.http.client import HTTPClient
+from mupl.image_validator import (
+    ENCODER_PROFILES,
+    DEFAULT_ENCODER_PROFILE,
+    GRAYSCALE_SUPPORTED,
+    create_worker_pool,
+)
 from mupl.uploader.uploader import ChapterUploader
 from mupl.exceptions import MuplException, MuplNotAFileError
 from mupl.loc.load import download_localisation
+from mupl.utils.cache import PageCache
 from mupl.utils.config import validate_path
+from mupl.utils.memory import MemoryBudget
+from mupl.utils.prefetch import ChapterPrefetcher
 from mupl.utils.logs import (
     format_log_dir_path,
     setup_logs,
@@ -45,6 +52,11 @@ class Mupl:
         max_log_days: int = 30,
         group_fallback_id: Optional[str] = None,
         number_threads: int = 3,
+        number_processes: int = 1,
+        encoder_profile: str = "balanced",
+        strip_metadata: bool = False,
+        grayscale_tolerance: Optional[int] = None,
+        verify_images: bool = False,
         language: str = "en",
         name_id_map_filename: str = "name_id_map.json",
         uploaded_dir_path: str = "uploaded",
@@ -52,6 +64,18 @@ class Mupl:
         mangadex_auth_url: str = "https://auth.mangadex.org/realms/mangadex/protocol/openid-connect",
         mdauth_filename: str = ".mdauth",
         verbose: bool = False,
+        cache_dir_path: Optional[str] = None,
+        max_cache_size_mb: int = 2048,
+        max_batch_size_mb: int = 150,
+        max_session_size_mb: int = 500,
+        max_image_size_mb: int = 20,
+        memory_budget_mb: int = 1024,
+        isolate_processing: bool = False,
+        recycle_workers_chapters: int = 50,
+        recycle_workers_mb: int = 4096,
+        processing_timeout: int = 300,
+        prefetch_chapters: int = 0,
+        prefetch_mb: int = 512,
         **kwargs,
     ):
         r"""
@@ -70,16 +94,33 @@ class Mupl:
             verbose_level (int, optional): Logs verbosity, 0=INFO, 1=DEBUG.
             number_of_images_upload (int, optional): Number of images to upload at once. Defaults to 10.
             upload_retry (int, optional): Number of retries for failed uploads. Defaults to 3.
-            ratelimit_time (int, optional): Time to wait between API calls. Defaults to 2.
+            ratelimit_time (int, optional): Seconds to back off after being rate limited without the API saying for how long, doubled each time in a row. Defaults to 2.
             logs_dir_path (str, optional): Directory where to store logs. Defaults to home path. Will create 'logs' folder in this directory.
             max_log_days (int, optional): Maximum number of days to keep logs. Defaults to 30.
             group_fallback_id (str, optional): Fallback group ID. Defaults to None.
             number_threads (int, optional): Number of threads for concurrent uploads. Defaults to 3.
+            number_processes (int, optional): Number of processes used to convert, combine and split images. 1 processes the images in the main process. Defaults to 1.
+            encoder_profile (str, optional): Encoder settings used when images are converted, combined or split. "fast" uses less CPU, "small" makes smaller images. One of "fast", "balanced" or "small". Defaults to "balanced".
+            strip_metadata (bool, optional): Remove the EXIF, XMP, comments and text metadata of JPEG and PNG images before uploading them. The images aren't re-encoded. Defaults to False.
+            grayscale_tolerance (int, optional): Re-encode pages without colour as grayscale. A page is grayscale if the colour channels of its pixels differ by at most this much, 0-255. Requires numpy. Defaults to None, pages aren't checked.
+            verify_images (bool, optional): Decode every image and check the zip CRCs before creating the upload session, chapters with corrupt images are skipped. Defaults to False.
             language (str, optional): Language for mupl localisation. Defaults to "en".
             name_id_map_filename (str): Path to name-ID mapping file. Will check your home directory for this file, if running as a dependency, otherwise will look in the current working directory. Defaults to "name_id_map.json"..
             uploaded_dir_path (str): Path to folder for uploaded files. Will check your home directory for this folder, if running as a dependency, otherwise will look in the current working directory. Defaults to "uploaded".
             mangadex_api_url (str): MangaDex API URL. Defaults to "https://api.mangadex.org".
             mangadex_auth_url (str): MangaDex auth URL. Defaults to "https://auth.mangadex.org/realms/mangadex/protocol/openid-connect".
+            cache_dir_path (str, optional): Directory to cache the converted, combined and split images in, so retried uploads don't process them again. Relative paths are in the home path. Defaults to None, no cache.
+            max_cache_size_mb (int, optional): Size of the image cache in megabytes, the least recently used images are deleted past this size. Defaults to 2048.
+            max_batch_size_mb (int, optional): Maximum size in megabytes of the images sent in one upload request. Defaults to 150.
+            max_session_size_mb (int, optional): Maximum size in megabytes of the images of one chapter upload session, bigger chapters are skipped. Defaults to 500.
+            max_image_size_mb (int, optional): Maximum size in megabytes of an image, bigger images are lossily compressed to fit. Defaults to 20.
+            memory_budget_mb (int, optional): Megabytes of decoded images that can be processed at once, estimated from the image dimensions. Images that don't fit wait for the others to finish. Defaults to 1024.
+            isolate_processing (bool, optional): Process the images in worker processes even if number_processes is 1, keeping the memory used by decoding out of the main process. Defaults to False.
+            recycle_workers_chapters (int, optional): Restart the worker processes after this many chapters. Defaults to 50.
+            recycle_workers_mb (int, optional): Restart the worker processes after they processed this many megabytes of images. Defaults to 4096.
+            processing_timeout (int, optional): Seconds a worker process can take to process an image before it's killed and the chapter is skipped. Defaults to 300.
+            prefetch_chapters (int, optional): Number of chapters after the one uploading to read in the background, for slow or network storage. Defaults to 0, chapters aren't read ahead.
+            prefetch_mb (int, optional): Megabytes of chapters that can be read ahead of the one uploading. Defaults to 512.
         """
 
         self.cli = bool(cli)
@@ -109,6 +150,56 @@ class Mupl:
         self.number_threads = max(
             1, int(number_threads) if number_threads is not None else 3
         )
+        self.number_processes = max(
+            1, int(number_processes) if number_processes is not None else 1
+        )
+        self.encoder_profile = (
+            str(encoder_profile).lower()
+            if encoder_profile is not None
+            else DEFAULT_ENCODER_PROFILE
+        )
+        if self.encoder_profile not in ENCODER_PROFILES:
+            logger.warning(
+                f"Unknown encoder profile: {encoder_profile}. Using {DEFAULT_ENCODER_PROFILE}."
+            )
+            self.encoder_profile = DEFAULT_ENCODER_PROFILE
+        self.strip_metadata = bool(strip_metadata)
+        self.grayscale_tolerance = (
+            min(255, max(0, int(grayscale_tolerance)))
+            if grayscale_tolerance is not None
+            else None
+        )
+        if self.grayscale_tolerance is not None and not GRAYSCALE_SUPPORTED:
+            logger.warning("numpy isn't installed, pages won't be checked for colour.")
+            self.grayscale_tolerance = None
+        self.verify_images = bool(verify_images)
+        self.isolate_processing = bool(isolate_processing)
+        self.max_batch_size = (
+            max(1, int(max_batch_size_mb) if max_batch_size_mb is not None else 150)
+            * 1024
+            * 1024
+        )
+        self.max_session_size = (
+            max(1, int(max_session_size_mb) if max_session_size_mb is not None else 500)
+            * 1024
+            * 1024
+        )
+        self.max_image_size = (
+            max(1, int(max_image_size_mb) if max_image_size_mb is not None else 20)
+            * 1024
+            * 1024
+        )
+        self.memory_budget = MemoryBudget(
+            max(1, int(memory_budget_mb) if memory_budget_mb is not None else 1024)
+            * 1024
+            * 1024
+        )
+        self.prefetch_chapters = max(
+            0, int(prefetch_chapters) if prefetch_chapters is not None else 0
+        )
+        self.prefetch_size = (
+            max(1, int(prefetch_mb) if prefetch_mb is not None else 512) * 1024 * 1024
+        )
         verbose_level = max(0, int(verbose_level) if verbose_level is not None else 0)
 
         self.mangadex_username = (
@@ -189,6 +280,22 @@ class Mupl:
         #     except OSError as e:
         #         logger.error(f"Failed to create {self.mdauth_path}: {e}")
 
+        self.page_cache = None
+        if cache_dir_path:
+            if os.path.isabs(cache_dir_path):
+                cache_dir_path = (
+                    cache_dir_path
+                    if isinstance(cache_dir_path, Path)
+                    else Path(cache_dir_path)
+                )
+            else:
+                cache_dir_path = self.home_path.joinpath(cache_dir_path)
+
+            max_cache_size_mb = max(
+                0, int(max_cache_size_mb) if max_cache_size_mb is not None else 2048
+            )
+            self.page_cache = PageCache(cache_dir_path, max_cache_size_mb * 1024 * 1024)
+
         if logs_dir_path:
             if os.path.isabs(logs_dir_path):
                 logs_dir_path = (
@@ -238,6 +345,28 @@ class Mupl:
             logger.info(f"Script path: {Path.cwd().absolute()}")
 
         self.translation = translation or download_localisation(self.language)
+        self.worker_pool = None
+        if self.isolate_processing or self.number_processes > 1:
+            self.worker_pool = create_worker_pool(
+                self.number_processes,
+                self.translation,
+                recycle_chapters=(
+                    int(recycle_workers_chapters)
+                    if recycle_workers_chapters is not None
+                    else 50
+                ),
+                recycle_bytes=(
+                    int(recycle_workers_mb) if recycle_workers_mb is not None else 4096
+                )
+                * 1024
+                * 1024,
+                timeout=(
+                    max(1, int(processing_timeout))
+                    if processing_timeout is not None
+                    else None
+                ),
+            )
+
         self.http_client = HTTPClient(
             mangadex_username=self.mangadex_username,
             mangadex_password=self.mangadex_password,
@@ -424,78 +553,118 @@ class Mupl:
         widestrip = bool(widestrip)
         combine = bool(combine)
 
+        prefetcher = None
+        if self.prefetch_chapters > 0 and len(zips_to_upload) > 1:
+            prefetcher = ChapterPrefetcher(
+                [
+                    (
+                        file_name_obj.to_upload
+                        if isinstance(file_name_obj, FileProcesser)
+                        else None
+                    )
+                    for file_name_obj in zips_to_upload
+                ],
+                lookahead=self.prefetch_chapters,
+                max_bytes=self.prefetch_size,
+            )
+            prefetcher.start()
+
         failed_uploads: List[Path] = []
-        for index, file_name_obj in enumerate(zips_to_upload, start=1):
-            if not isinstance(file_name_obj, FileProcesser):
-                logger.warning(
-                    f"Skipping invalid file processor object: {file_name_obj}"
-                )
-                continue
+        try:
+            for index, file_name_obj in enumerate(zips_to_upload, start=1):
+                if prefetcher is not None:
+                    prefetcher.advance(index - 1)
 
-            uploader_process = None
-            try:
-                print(
-                    f"\n\n{self.translation.get('uploading_draft', 'Uploading draft')} {str(file_name_obj)}\n{'-' * 40}"
-                )
+                if not isinstance(file_name_obj, FileProcesser):
+                    logger.warning(
+                        f"Skipping invalid file processor object: {file_name_obj}"
+                    )
+                    continue
 
-                uploader_process = ChapterUploader(
-                    self.http_client,
-                    file_name_obj,
-                    names_to_ids,
-                    failed_uploads,
-                    verbose=self.verbose,
-                    mangadex_api_url=self.mangadex_api_url,
-                    upload_retry=self.upload_retry,
-                    translation=self.translation,
-                    number_threads=self.number_threads,
-                    uploaded_files=self.uploaded_files,
-                    ratelimit_time=self.ratelimit_time,
-                    move_files=self.move_files,
-                    number_of_images_upload=self.number_of_images_upload,
-                    widestrip=widestrip,
-                    combine=combine,
-                    cli=self.cli,
-                    home_path=self.home_path,
-                    **kwargs,
-                )
+                uploader_process = None
+                try:
+                    print(
+                        f"\n\n{self.translation.get('uploading_draft', 'Uploading draft')} {str(file_name_obj)}\n{'-' * 40}"
+                    )
 
-                upload_success = uploader_process.upload()
-                del uploader_process
+                    uploader_process = ChapterUploader(
+                        self.http_client,
+                        file_name_obj,
+                        names_to_ids,
+                        failed_uploads,
+                        verbose=self.verbose,
+                        mangadex_api_url=self.mangadex_api_url,
+                        upload_retry=self.upload_retry,
+                        translation=self.translation,
+                        number_threads=self.number_threads,
+                        number_processes=self.number_processes,
+                        encoder_profile=self.encoder_profile,
+                        strip_metadata=self.strip_metadata,
+                        grayscale_tolerance=self.grayscale_tolerance,
+                        verify_images=self.verify_images,
+                        page_cache=self.page_cache,
+                        max_batch_size=self.max_batch_size,
+                        max_session_size=self.max_session_size,
+                        max_image_size=self.max_image_size,
+                        memory_budget=self.memory_budget,
+                        worker_pool=self.worker_pool,
+                        isolate_processing=self.isolate_processing,
+                        uploaded_files=self.uploaded_files,
+                        ratelimit_time=self.ratelimit_time,
+                        move_files=self.move_files,
+                        number_of_images_upload=self.number_of_images_upload,
+                        widestrip=widestrip,
+                        combine=combine,
+                        cli=self.cli,
+                        home_path=self.home_path,
+                        **kwargs,
+                    )
 
-                print(
-                    f"{'-'*10}\n{self.translation.get('finish_upload', 'Finished upload')} {str(file_name_obj)}\n{'-' * 10}"
-                )
-                logger.debug("Sleeping between zip upload.")
-                time.sleep(self.ratelimit_time * 2)
-            except KeyboardInterrupt as e:
-                logger.warning(
-                    f"Keyboard Interrupt detected during upload of {str(file_name_obj)}"
-                )
+                    upload_success = uploader_process.upload()
+                    del uploader_process
 
-                print(
-                    self.translation.get(
-                        "keyboard_interrupt_exit",
-                        "Keyboard interrupt detected, exiting",
+                    print(
+                        f"{'-'*10}\n{self.translation.get('finish_upload', 'Finished upload')} {str(file_name_obj)}\n{'-' * 10}"
                     )
-                )
-                try:
-                    asyncio.get_event_loop().stop()
-                    asyncio.get_event_loop().close()
-                    uploader_process.remove_upload_session()
-                    if not uploader_process.folder_upload and uploader_process.myzip:
-                        uploader_process.myzip.close()
-                    del uploader_process
-                except UnboundLocalError:
-                    pass
+                except KeyboardInterrupt as e:
+                    logger.warning(
+                        f"Keyboard Interrupt detected during upload of {str(file_name_obj)}"
+                    )
+
+                    print(
+                        self.translation.get(
+                            "keyboard_interrupt_exit",
+                            "Keyboard interrupt detected, exiting",
+                        )
+                    )
+                    try:
+                        uploader_process.remove_upload_session()
+                        if (
+                            not uploader_process.folder_upload
+                            and uploader_process.myzip
+                        ):
+                            uploader_process.myzip.close()
+                        del uploader_process
+                    except UnboundLocalError:
+                        pass
+                    finally:
+                        failed_uploads.append(file_name_obj.to_upload)
+                        raise MuplException(e)
                 finally:
-                    failed_uploads.append(file_name_obj.to_upload)
-                    raise MuplException(e)
-            finally:
-                if "uploader_process" in locals() and uploader_process is not None:
-                    del uploader_process
-                    import gc
+                    if "uploader_process" in locals() and uploader_process is not None:
+                        del uploader_process
+                        import gc
+
+                        gc.collect()
+        finally:
+            if prefetcher is not None:
+                prefetcher.close()
+
+            if self.worker_pool is not None:
+                self.worker_pool.shutdown()
 
-                    gc.collect()
+            # The uploads are done or stopped, the token doesn't need to be kept fresh
+            self.http_client.close()
 
         if failed_uploads:
             logger.info(f"Failed uploads: {[f.name for f in failed_uploads]}")
@@ -529,6 +698,7 @@ class Mupl:
         Keyword Args:
             widestrip: If the chapter is a widestrip. Defaults to False.
             combine: If small images should be combined with other images (either before or after). Defaults to False.
+            threaded: If the image batches should be uploaded concurrently, using `number_threads` workers. Defaults to False.
 
         Returns:
             '*None*' if no valid chapters were found. Otherwise, a list of Path objects for chapters that failed to upload.
@@ -605,6 +775,7 @@ class Mupl:
             publish_date: A datetime object for scheduled publishing. Optional.
             widestrip: If the chapter is a widestrip. Defaults to False.
             combine: If small images should be combined with other images (either before or after). Defaults to False.
+            threaded: If the image batches should be uploaded concurrently, using `number_threads` workers. Defaults to False.
 
         Returns:
             True if the upload was successful, False otherwise.
@@ -46,6 +46,18 @@ class MuplValidationError(MuplException):
     pass
 
 
+class MuplImageTooLargeError(MuplValidationError):
+    """Raised when an image is too big to decode safely."""
+
+    pass
+
+
+class MuplProcessingTimeoutError(MuplException):
+    """Raised when processing images takes longer than the worker timeout."""
+
+    pass
+
+
 class MuplNotAFileError(MuplException):
     """Raised when a path is not a file."""
 
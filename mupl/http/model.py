@@ -1,9 +1,8 @@
 import json
 import logging
-import time
 from datetime import datetime, timedelta, timezone
 from pathlib import Path
-from threading import Timer
+from threading import Lock, RLock, Timer, local
 from typing import Optional, Dict
 
 import requests
@@ -13,10 +12,14 @@ from mupl.exceptions import MuplLoginError, MuplTermsNotAccepted
 from mupl.http import RequestError, http_error_codes
 from mupl.http.response import HTTPResponse
 from mupl.http.oauth import OAuth2
+from mupl.http.ratelimit import RateLimiter
 
 
 logger = logging.getLogger("mupl")
 
+# Access tokens are refreshed when they expire in less than this many seconds
+TOKEN_EXPIRY_MARGIN = 60
+
 
 def raise_error(ex):
     raise ex
@@ -39,8 +42,11 @@ class HTTPModel:
         cli: bool,
         **kwargs,
     ) -> None:
+        # The session's headers aren't changed after this, the auth header is sent per
+        # request so threads never see it half updated
         self.session = requests.Session()
         self.session.headers.update({"User-Agent": f"mupl/{__version__}"})
+        self._auth_token: "Optional[str]" = None
 
         self.upload_retry_total = upload_retry
         self.ratelimit_time = ratelimit_time
@@ -50,11 +56,16 @@ class HTTPModel:
         self.translation = translation
         self.cli = cli
 
-        self.max_requests = 5
-        self.number_of_requests = 0
-        self.total_requests = 0
-        self.total_not_login_row = 0
+        # Shared by every thread uploading through this client
+        self.rate_limiter = RateLimiter(backoff=self.ratelimit_time)
+        # 401s in a row are counted per thread, one thread's requests don't end another's
+        self._thread_state = local()
+        self._state_lock = Lock()
         self._token_file = self.mdauth_path
+        self._saved_tokens: "Optional[dict]" = None
+        self._token_lock = RLock()
+        self._refresh_timer: "Optional[Timer]" = None
+        self._refresh_timer_token: "Optional[str]" = None
 
         credential_config = type(
             "SectionProxy",
@@ -75,9 +86,15 @@ class HTTPModel:
 
         if self._token_file.exists():
             self._file_token = self._open_auth_file()
-            access_token = self._file_token.get("access_token")
-            refresh_token = self._file_token.get("refresh_token")
+            # Older versions read and wrote different keys
+            access_token = self._file_token.get(
+                "access", self._file_token.get("access_token")
+            )
+            refresh_token = self._file_token.get(
+                "refresh", self._file_token.get("refresh_token")
+            )
             self.terms_accepted = self._file_token.get("terms", 1)
+            self._saved_tokens = self._file_token
 
         self.oauth = OAuth2(
             credential_config,
@@ -91,6 +108,14 @@ class HTTPModel:
         self._first_login = True
         self._successful_login = False
 
+    @property
+    def total_not_login_row(self) -> int:
+        return getattr(self._thread_state, "total_not_login_row", 0)
+
+    @total_not_login_row.setter
+    def total_not_login_row(self, value: int) -> None:
+        self._thread_state.total_not_login_row = value
+
     @property
     def upload_terms_accepted(self) -> bool:
         return self._check_terms_accepted()
@@ -103,63 +128,6 @@ class HTTPModel:
     def refresh_token(self) -> Optional[str]:
         return self.oauth.refresh_token
 
-    def _calculate_sleep_time(
-        self, status_code: "int", wait: "bool", headers: "dict"
-    ) -> "bool":
-        self.number_of_requests += 1
-        self.total_requests += 1
-        loop = False
-
-        limit = int(headers.get("x-ratelimit-limit", self.max_requests))
-        remaining = int(
-            headers.get(
-                "x-ratelimit-remaining", self.max_requests - self.number_of_requests
-            )
-        )
-        retry_after = headers.get("x-ratelimit-retry-after", None)
-
-        logger.debug(f"limit: {limit}")
-        logger.debug(f"remaining: {remaining}")
-        logger.debug(f"retry_after: {retry_after}")
-        logger.debug(f"number_of_requests: {self.number_of_requests}")
-
-        delta = self.max_requests
-        sleep = delta / limit if limit > 0 else self.ratelimit_time
-        if status_code == 429:
-            error_message = f"429: {http_error_codes.get('429')}"
-            logger.warning(error_message)
-            sleep = 60
-            loop = True
-
-        if retry_after is not None:
-            retry = datetime.fromtimestamp(int(retry_after))
-            now = datetime.now()
-            if retry > now:
-                difference = retry - now
-            else:
-                difference = now - now
-
-            delta = difference.total_seconds() + 1
-            if remaining == 0:
-                sleep = delta
-                loop = True
-            else:
-                sleep = delta / remaining
-
-        logger.debug("delta is: %s", delta)
-
-        if remaining <= 0 or retry_after is not None or status_code == 429:
-            if not wait and status_code != 429 and remaining > 0:
-                return loop
-
-            self.number_of_requests = 0
-            logger.debug(f"Sleeping {sleep} seconds")
-            time.sleep(sleep)
-
-            if remaining == 0 and status_code != 429:
-                loop = False
-        return loop
-
     def _format_request_log(
         self,
         method: "str",
@@ -191,7 +159,6 @@ class HTTPModel:
         run_number = 0
 
         tries = kwargs.get("tries", self.upload_retry_total)
-        sleep = kwargs.get("sleep", True)
 
         if not route.startswith(("http://", "https://")):
             full_route = f"{self.mangadex_api_url}{route}"
@@ -214,8 +181,21 @@ class HTTPModel:
             try:
                 run_number += 1
 
+                with self._state_lock:
+                    auth_token = self._auth_token
+                headers = (
+                    {"Authorization": f"Bearer {auth_token}"} if auth_token else None
+                )
+
+                self.rate_limiter.wait(method, full_route)
                 response = self.session.request(
-                    method, full_route, json=json, params=params, data=data, files=files
+                    method,
+                    full_route,
+                    json=json,
+                    params=params,
+                    data=data,
+                    files=files,
+                    headers=headers,
                 )
                 logger.debug(
                     f"Initial Request: Code {response.status_code}, URL: {response.url}"
@@ -233,15 +213,14 @@ class HTTPModel:
                 else:
                     self.total_not_login_row = 0
 
-                loop = self._calculate_sleep_time(
-                    status_code=response.status_code,
-                    headers=response.headers,
-                    wait=sleep,
+                self.rate_limiter.update(
+                    method, full_route, response.status_code, response.headers
                 )
 
                 retry -= 1
                 total_retry -= 1
-                if loop:
+                if response.status_code == 429:
+                    # The rate limiter waits before the retry is sent
                     continue
             except requests.RequestException as e:
                 logger.error(e)
@@ -267,7 +246,7 @@ class HTTPModel:
             if response.status_code == 401:
                 response_obj.print_error()
                 try:
-                    if not self._login():
+                    if not self._relogin(auth_token):
                         logger.error("Re-login attempt failed.")
 
                         pass
@@ -378,8 +357,25 @@ class HTTPModel:
             logger.info(f"User agreed to the MangaDex ToS.")
             return True
 
+    def _relogin(self, rejected_token: "Optional[str]") -> "bool":
+        """Log in again after MangaDex rejected `rejected_token`.
+        Only the first thread rejected with a token refreshes it, the others wait for
+        it and use the new token."""
+        with self._token_lock:
+            if self.access_token is not None and self.access_token != rejected_token:
+                logger.debug("Access token was already refreshed by another thread.")
+                return True
+
+            self.oauth.invalidate_access_token()
+            return self._login_locked()
+
     def _login(self, recursed=False) -> "bool":
-        """Attempt to ensure the client is logged in."""
+        """Attempt to ensure the client is logged in.
+        Access tokens that don't expire soon are trusted without asking MangaDex."""
+        with self._token_lock:
+            return self._login_locked(recursed)
+
+    def _login_locked(self, recursed=False) -> "bool":
         if self._first_login:
             logger.debug("Trying to login through the mdauth file.")
 
@@ -406,9 +402,8 @@ class HTTPModel:
                     )
                 )
 
-        if self.access_token is not None:
-            self._update_headers(self.access_token)
-            logged_in = self._check_login()
+        if self.oauth.access_token_expires_in > TOKEN_EXPIRY_MARGIN:
+            logged_in = True
         else:
             logged_in = self._refresh_token_md()
 
@@ -419,6 +414,7 @@ class HTTPModel:
             self._save_tokens(
                 self.access_token, self.refresh_token, self.terms_accepted
             )
+            self._schedule_refresh()
 
             if self._first_login:
                 logger.info(f"Logged into mangadex.")
@@ -430,7 +426,8 @@ class HTTPModel:
                 if self._token_file.exists():
                     logger.warning(f"Deleting mdauth file and trying again.")
                     self._token_file.unlink()
-                    self._login(recursed=True)
+                    self._saved_tokens = None
+                    return self._login_locked(recursed=True)
 
         logger.critical("All login attempts failed.")
         raise MuplLoginError("Couldn't login, check logs for error.")
@@ -450,23 +447,24 @@ class HTTPModel:
     def _save_tokens(
         self, access_token: "str", refresh_token: "str", termsAccepted: "int"
     ) -> None:
-        """Save the access and refresh tokens."""
+        """Save the access and refresh tokens, if they changed since they were saved."""
+        tokens = {
+            "access": access_token,
+            "refresh": refresh_token,
+            "terms": termsAccepted,
+        }
+        if tokens == self._saved_tokens:
+            return
+
         with open(self._token_file, "w") as login_file:
-            login_file.write(
-                json.dumps(
-                    {
-                        "access": access_token,
-                        "refresh": refresh_token,
-                        "terms": termsAccepted,
-                    },
-                    indent=4,
-                )
-            )
+            login_file.write(json.dumps(tokens, indent=4))
+        self._saved_tokens = tokens
         logger.debug("Saved mdauth file.")
 
     def _update_headers(self, access_token: "str") -> None:
-        """Update the session headers to include the auth token."""
-        self.session.headers.update({"Authorization": f"Bearer {access_token}"})
+        """Send the auth token with the next requests."""
+        with self._state_lock:
+            self._auth_token = access_token
 
     def _refresh_token_md(self) -> "bool":
         """Use the refresh token to get a new access token via OAuth client."""
@@ -479,31 +477,52 @@ class HTTPModel:
         logger.debug(f"Regenerating refresh token.")
         return self.oauth.regenerate_access_token()
 
-    def _check_login(self) -> "bool":
-        """Check if the current access token is valid using the /auth/check endpoint."""
-        try:
-            auth_check_response = self._request(
-                "GET",
-                f"{self._md_auth_api_url}/check",
-                successful_codes=[401, 403, 404],
-                tries=1,
-            )
-        except RequestError as e:
-            logger.error(e)
-        else:
-            if (
-                auth_check_response.status_code == 200
-                and auth_check_response.data is not None
-            ):
-                if auth_check_response.data["isAuthenticated"]:
-                    logger.debug(
-                        f"Already logged in: {auth_check_response.data['isAuthenticated']=}"
-                    )
-                    return True
-
-        if self.refresh_token is None:
-            return self._login_using_details()
-        return self._refresh_token_md()
+    def _schedule_refresh(self) -> None:
+        """Refresh the access token in the background before it expires."""
+        if (
+            self._refresh_timer is not None
+            and self._refresh_timer_token == self.access_token
+        ):
+            return
+
+        if self._refresh_timer is not None:
+            self._refresh_timer.cancel()
+
+        delay = self.oauth.access_token_expires_in - TOKEN_EXPIRY_MARGIN * 2
+        self._refresh_timer = Timer(max(0, delay), self._refresh_in_background)
+        self._refresh_timer.daemon = True
+        self._refresh_timer_token = self.access_token
+        self._refresh_timer.start()
+
+    def close(self) -> None:
+        """Stop refreshing the access token in the background.
+        Logging in again schedules the refresh again."""
+        with self._token_lock:
+            if self._refresh_timer is not None:
+                self._refresh_timer.cancel()
+            self._refresh_timer = None
+            self._refresh_timer_token = None
+
+    def _refresh_in_background(self) -> None:
+        with self._token_lock:
+            if self._refresh_timer_token != self.access_token:
+                # Already refreshed
+                return
+
+            logger.debug("Refreshing the access token before it expires.")
+            try:
+                refreshed = self._refresh_token_md()
+            except Exception as e:
+                logger.error(f"Couldn't refresh the access token: {e}")
+                refreshed = False
+
+            self._refresh_timer = None
+            if refreshed:
+                self._update_headers(self.access_token)
+                self._save_tokens(
+                    self.access_token, self.refresh_token, self.terms_accepted
+                )
+                self._schedule_refresh()
 
     def _login_using_details(self) -> "bool":
         """Login using account details via OAuth client."""
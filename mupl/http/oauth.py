@@ -107,6 +107,14 @@ class OAuth2:
     def access_token_expired(self) -> "bool":
         return self.__token_expired(self.access_token)
 
+    @property
+    def access_token_expires_in(self) -> "float":
+        return self.token_expires_in(self.access_token)
+
+    def invalidate_access_token(self):
+        """Forget the access token after MangaDex rejected it, so it's refreshed."""
+        self.__access_token = None
+
     @property
     def refresh_token(self) -> "str":
         return self.__refresh_token
@@ -132,10 +140,20 @@ class OAuth2:
         return self.__client_secret
 
     @staticmethod
-    def __token_expired(token: "str") -> "bool":
+    def token_expires_in(token: "Optional[str]") -> "float":
+        """Seconds until the token's `exp`, 0 if it's missing or can't be read."""
         if not token:
-            return True
-        payload_string = base64.b64decode(token.split(".")[1] + "===").decode("utf-8")
-        expiry_time = json.loads(payload_string)["exp"]
-        current_time = int(time.time())
-        return (expiry_time - current_time) <= 0
+            return 0
+        try:
+            payload_string = base64.urlsafe_b64decode(
+                token.split(".")[1] + "==="
+            ).decode("utf-8")
+            expiry_time = json.loads(payload_string)["exp"]
+        except (IndexError, KeyError, TypeError, ValueError):
+            logger.warning("Couldn't read the expiry time of a token.")
+            return 0
+        return max(0, expiry_time - time.time())
+
+    @staticmethod
+    def __token_expired(token: "str") -> "bool":
+        return OAuth2.token_expires_in(token) <= 0
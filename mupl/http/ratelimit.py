@@ -0,0 +1,167 @@
+import logging
+import re
+import threading
+import time
+from typing import Dict, Mapping, Optional
+from urllib.parse import urlsplit
+
+logger = logging.getLogger("mupl")
+
+# MangaDex allows 5 requests a second from an IP, routes with a lower limit send headers
+REQUESTS_PER_SECOND = 5
+MAX_BACKOFF = 60
+
+UUID_PATTERN = re.compile(
+    r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}", re.IGNORECASE
+)
+
+
+class TokenBucket:
+    """Holds up to `capacity` tokens, refilled at `rate` tokens a second.
+
+    Tokens are reserved ahead of time, so callers waiting at once are spaced out
+    instead of all sending when a token comes back."""
+
+    def __init__(self, capacity: float, rate: float) -> None:
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def reserve(self, now: float) -> float:
+        """Take a token, returning the seconds to wait before it can be used."""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        return max(wait, self.blocked_until - now)
+
+
+class RouteLimit:
+    """The window of a route from its `x-ratelimit` headers."""
+
+    def __init__(self, limit: int, remaining: int, reset_at: float) -> None:
+        self.limit = limit
+        self.remaining = remaining
+        self.reset_at = reset_at
+
+    def reserve(self, now: float) -> float:
+        if now >= self.reset_at:
+            # The window was reset, wait for the next response to learn the new one
+            self.remaining = self.limit
+            self.reset_at = float("inf")
+
+        self.remaining -= 1
+        if self.remaining >= 0 or self.reset_at == float("inf"):
+            return 0
+        return self.reset_at - now
+
+
+class RateLimiter:
+    """Paces the requests of every thread using a client to stay under the rate limits.
+
+    Every request takes a token from a bucket shared by all routes. Routes that send
+    `x-ratelimit-limit`, `x-ratelimit-remaining` and `x-ratelimit-retry-after` headers
+    also wait for their window to reset once their requests are used up. A 429 without
+    those headers backs off for `backoff` seconds, doubling each time it happens in a row.
+    """
+
+    def __init__(
+        self,
+        requests_per_second: float = REQUESTS_PER_SECOND,
+        backoff: float = 2,
+        max_backoff: float = MAX_BACKOFF,
+    ) -> None:
+        self.backoff = max(0, backoff)
+        self.max_backoff = max(self.backoff, max_backoff)
+        # Room for a single token, so requests are spaced evenly and no second
+        # gets a burst on top of the rate
+        self._bucket = TokenBucket(1, requests_per_second)
+        self._routes: "Dict[str, RouteLimit]" = {}
+        self._strikes: "Dict[str, int]" = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def route_key(method: "str", url: "str") -> "str":
+        """Group the requests to the same endpoint, whatever ids are in the url."""
+        parts = urlsplit(url)
+        path = UUID_PATTERN.sub("{id}", parts.path.rstrip("/"))
+        return f"{method.upper()} {parts.netloc}{path}"
+
+    def wait(self, method: "str", url: "str") -> None:
+        """Block until a request to the url can be sent."""
+        key = self.route_key(method, url)
+        with self._lock:
+            now = time.monotonic()
+            wait = self._bucket.reserve(now)
+            route = self._routes.get(key)
+            if route is not None:
+                wait = max(wait, route.reserve(now))
+
+        if wait > 0:
+            logger.debug(f"Waiting {wait:.2f} seconds before {key}.")
+            time.sleep(wait)
+
+    def update(
+        self,
+        method: "str",
+        url: "str",
+        status_code: int,
+        headers: "Mapping[str, str]",
+    ) -> None:
+        """Learn the route's rate limit from the response headers."""
+        key = self.route_key(method, url)
+        limit = self._header_int(headers, "x-ratelimit-limit")
+        remaining = self._header_int(headers, "x-ratelimit-remaining")
+        retry_after = self._header_int(headers, "x-ratelimit-retry-after")
+        if retry_after is None:
+            retry_after_seconds = self._header_int(headers, "retry-after")
+        else:
+            retry_after_seconds = retry_after - time.time()
+
+        with self._lock:
+            now = time.monotonic()
+            if limit is not None and remaining is not None:
+                reset_at = now + max(0, retry_after_seconds or 0)
+                route = self._routes.get(key)
+                if (
+                    route is None
+                    or route.reset_at == float("inf")
+                    or reset_at > route.reset_at + 1
+                ):
+                    # A new window, the headers are newer than what was counted locally
+                    self._routes[key] = RouteLimit(limit, remaining, reset_at)
+                else:
+                    route.limit = limit
+                    route.remaining = min(route.remaining, remaining)
+
+            if status_code != 429:
+                self._strikes.pop(key, None)
+                return
+
+            strikes = self._strikes.get(key, 0)
+            self._strikes[key] = strikes + 1
+            if retry_after_seconds is not None:
+                wait = max(0, retry_after_seconds)
+            else:
+                wait = min(self.max_backoff, self.backoff * 2**strikes)
+
+            route = self._routes.get(key)
+            if route is not None and limit is not None:
+                route.remaining = 0
+                route.reset_at = max(route.reset_at, now + wait)
+            else:
+                # Without route headers it's the limit on every request
+                self._bucket.blocked_until = max(self._bucket.blocked_until, now + wait)
+            logger.warning(f"Rate limited on {key}, waiting {wait:.2f} seconds.")
+
+    @staticmethod
+    def _header_int(headers: "Mapping[str, str]", name: "str") -> "Optional[int]":
+        value = headers.get(name)
+        if value is None:
+            return None
+        try:
+            return int(float(value))
+        except (TypeError, ValueError):
+            return None
@@ -1,19 +1,130 @@
+import collections
+import contextlib
 import enum
 import io
+import itertools
 import logging
 import math
+import mmap
+import multiprocessing
+import os
+import queue
 import string
+import struct
+import threading
 import zipfile
+import zlib
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
-from typing import List, Dict, Union, Literal, Optional
-from typing import Tuple
+from typing import List, Dict, Union, Literal, Optional, Iterable, Iterator
+from typing import NamedTuple, Tuple
 
 import natsort
-from PIL import Image, ImageSequence
+from PIL import Image, JpegImagePlugin, UnidentifiedImageError
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# The grayscale detection needs numpy
+GRAYSCALE_SUPPORTED = np is not None
+
+from mupl.exceptions import (
+    MuplImageTooLargeError,
+    MuplProcessingTimeoutError,
+    MuplUploadSessionError,
+    MuplValidationError,
+)
+from mupl.utils.buffer import BufferReader
+from mupl.utils.cache import PageCache
+from mupl.utils.memory import MemoryBudget
+from mupl.utils.shared_pages import SHARED_MEMORY_SUPPORTED, SharedPages
+from mupl.utils.workers import WorkerPool
+from mupl.utils.zip_reader import ParallelZipReader
 
 logger = logging.getLogger("mupl")
 
-Image.MAX_IMAGE_PIXELS = None
+# Bigger images are rejected before they are decoded, Pillow refuses to open images
+# over twice this size
+MAX_IMAGE_PIXELS = 250_000_000
+Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# Bytes per pixel of the 8 bit PNG colour types
+PNG_CHANNELS = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}
+PNG_MODES = {0: "L", 2: "RGB", 3: "P", 4: "LA", 6: "RGBA"}
+
+# Chapters with fewer images are processed in-process, starting the workers would take longer
+MIN_IMAGES_PROCESS_POOL = 8
+
+# MangaDex upload limits, in bytes
+MAX_BATCH_SIZE = 150 * 1024 * 1024
+MAX_SESSION_SIZE = 500 * 1024 * 1024
+MAX_IMAGE_SIZE = 20 * 1024 * 1024
+
+MEMORY_BUDGET = 1024 * 1024 * 1024
+
+# Bytes of PNG image data inflated at a time when decoding it in bands
+PNG_INFLATE_SIZE = 1024 * 1024
+
+# Bytes of a compressed zip member decompressed to read its header
+IMAGE_HEADER_SIZE = 256 * 1024
+
+# PNG chunks kept by the metadata stripper, other ancillary chunks are dropped
+PNG_KEPT_CHUNKS = {
+    b"tRNS",
+    b"gAMA",
+    b"cHRM",
+    b"sRGB",
+    b"iCCP",
+    b"sBIT",
+    b"acTL",
+    b"fcTL",
+    b"fdAT",
+}
+
+# Rows of a page checked at a time by the grayscale detection
+GRAYSCALE_BAND_ROWS = 512
+
+# JPEG qualities tried for pages over the file size limit, the last one is the floor
+JPEG_QUALITY_STEPS = (90, 80, 70, 60)
+
+
+class EncoderProfile(NamedTuple):
+    """Encoder settings used when images are converted, combined or split."""
+
+    png_compress_level: int
+    # zlib strategy used for the PNG image data
+    png_compress_type: int
+    jpeg_quality: int
+    # 0 is 4:4:4, 1 is 4:2:2 and 2 is 4:2:0
+    jpeg_subsampling: int
+    jpeg_progressive: bool
+    jpeg_optimize: bool
+    # Reuse the quantisation tables and subsampling of JPEG source images
+    jpeg_keep_qtables: bool
+
+
+ENCODER_PROFILES = {
+    "fast": EncoderProfile(1, zlib.Z_DEFAULT_STRATEGY, 90, 2, False, False, True),
+    "balanced": EncoderProfile(6, zlib.Z_DEFAULT_STRATEGY, 90, 2, False, True, True),
+    "small": EncoderProfile(9, zlib.Z_FILTERED, 85, 2, True, True, False),
+}
+DEFAULT_ENCODER_PROFILE = "balanced"
+
+# Luminance quantisation table the JPEG standard scales by the quality, quality 50
+JPEG_STANDARD_LUMINANCE_TABLE = (
+    (16, 11, 10, 16, 24, 40, 51, 61),
+    (12, 12, 14, 19, 26, 58, 60, 55),
+    (14, 13, 16, 24, 40, 57, 69, 56),
+    (14, 17, 22, 29, 51, 87, 80, 62),
+    (18, 22, 37, 56, 68, 109, 103, 77),
+    (24, 35, 55, 64, 81, 104, 113, 92),
+    (49, 64, 78, 87, 103, 121, 120, 101),
+    (72, 92, 95, 98, 112, 100, 103, 99),
+)
 
 
 class Format(enum.Enum):
@@ -24,20 +135,69 @@ class Format(enum.Enum):
     WEBP = 4
 
 
+class ImageInfo(NamedTuple):
+    """Header only description of an image, probed once and reused by every processing step."""
+
+    format: "Format"
+    width: int
+    height: int
+    mode: str
+    frames: int
+    size: int
+
+
+class Page(NamedTuple):
+    """An upload ready page, the ordinal is its position in the chapter."""
+
+    ordinal: int
+    name: str
+    data: bytes
+
+
+class PageManifestEntry(NamedTuple):
+    name: str
+    source: str
+    converted_format: "Optional[str]"
+
+
+class PageManifest:
+    """Names of the chapter's pages by ordinal, without the image data."""
+
+    __slots__ = ("_entries",)
+
+    def __init__(self) -> None:
+        self._entries: "List[PageManifestEntry]" = []
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __getitem__(self, ordinal: int) -> "PageManifestEntry":
+        return self._entries[ordinal]
+
+    def add(
+        self, name: "str", source: "str", converted_format: "Optional[str]" = None
+    ) -> int:
+        """Add the next page, returns its ordinal."""
+        self._entries.append(PageManifestEntry(name, source, converted_format))
+        return len(self._entries) - 1
+
+
 class ImageProcessorBase:
     translation = {}
 
     @staticmethod
-    def key(x: "tuple") -> "Union[Literal[0], str]":
+    def key(x: "Union[str, tuple]") -> "Union[Literal[0], str]":
         """Give a higher priority in sorting for images with their first character a punctuation."""
-        if Path(x[0]).name[0].lower() in string.punctuation:
+        name = x if isinstance(x, str) else x[0]
+        if Path(name).name[0].lower() in string.punctuation:
             return 0
         else:
-            return x[0]
+            return name
 
     @staticmethod
     def get_image_format(image_bytes: "bytes") -> "Optional[Format]":
         """Returns the image type from the first few bytes."""
+        image_bytes = bytes(image_bytes[:12])
         if image_bytes.startswith(b"\x89\x50\x4e\x47\x0d\x0a\x1a\x0a"):
             return Format.PNG
 
@@ -58,165 +218,946 @@ class ImageProcessorBase:
         return None
 
     @staticmethod
-    def get_new_format_for_webp(image_bytes: "bytes") -> "str":
-        with Image.open(io.BytesIO(image_bytes)) as image:
-            try:
-                _ = ImageSequence.Iterator(image)[1]
-                return "GIF"
-            except IndexError:
-                pass
+    def probe_image(image_bytes: "bytes") -> "Optional[ImageInfo]":
+        """Read the image format, dimensions, mode and frame count from the image header.
+        No pixel data is decoded. Returns None for files that aren't images, raises
+        `MuplValidationError` for images whose header can't be read."""
+        image_format = ImageProcessorBase.get_image_format(image_bytes)
+        if image_format is None:
+            return None
+
+        try:
+            with _open_image(image_bytes) as image:
+                frames = 1
+                if image_format in (Format.GIF, Format.WEBP) and getattr(
+                    image, "is_animated", False
+                ):
+                    frames = image.n_frames
+
+                return ImageInfo(
+                    format=image_format,
+                    width=image.width,
+                    height=image.height,
+                    mode=image.mode,
+                    frames=frames,
+                    size=len(image_bytes),
+                )
+        except Image.DecompressionBombError as e:
+            # Pillow won't open them, PNGs decoded in bands only need the header
+            header = ImageProcessorBase._read_png_band_header(image_bytes)
+            if header is None:
+                raise MuplImageTooLargeError(str(e)) from e
+            width, height, colour_type, _, _ = header
+            return ImageInfo(
+                format=image_format,
+                width=width,
+                height=height,
+                mode=PNG_MODES[colour_type],
+                frames=1,
+                size=len(image_bytes),
+            )
+        except (UnidentifiedImageError, OSError) as e:
+            raise MuplValidationError(f"Couldn't read the image header: {e}") from e
+
+    @staticmethod
+    def get_new_format_for_webp(image_info: "ImageInfo") -> "str":
+        if image_info.frames > 1:
+            return "GIF"
+
+        if image_info.mode == "RGBA":
+            return "PNG"
+
+        return "JPEG"
+
+    @staticmethod
+    def get_save_params(
+        image_format: "str",
+        encoder_profile: "EncoderProfile",
+        source: "Optional[Image.Image]" = None,
+    ) -> "dict":
+        """Pillow save parameters of the encoder profile for the format.
+        `source` is the image it was made from, to reuse its JPEG tables."""
+        if image_format == "PNG":
+            return {
+                "compress_level": encoder_profile.png_compress_level,
+                "compress_type": encoder_profile.png_compress_type,
+            }
+
+        if image_format != "JPEG":
+            return {}
+
+        params = {
+            "quality": encoder_profile.jpeg_quality,
+            "subsampling": encoder_profile.jpeg_subsampling,
+            "progressive": encoder_profile.jpeg_progressive,
+            "optimize": encoder_profile.jpeg_optimize,
+        }
+        if (
+            encoder_profile.jpeg_keep_qtables
+            and isinstance(source, JpegImagePlugin.JpegImageFile)
+            and source.quantization
+        ):
+            # Pillow scales the tables by the quality if both are given
+            del params["quality"]
+            params["qtables"] = source.quantization
+            subsampling = JpegImagePlugin.get_sampling(source)
+            if subsampling != -1:
+                params["subsampling"] = subsampling
+        elif isinstance(source, JpegImagePlugin.JpegImageFile) and source.quantization:
+            # Re-encoding above the source's quality only makes the image bigger
+            params["quality"] = min(
+                params["quality"],
+                ImageProcessorBase.estimate_jpeg_quality(source.quantization),
+            )
+        return params
 
-            if image.mode == "RGBA":
-                return "PNG"
+    @staticmethod
+    def estimate_jpeg_quality(quantization: "Dict[int, List[int]]") -> int:
+        """Estimate the quality a JPEG was saved with from its luminance table,
+        the inverse of the scaling the standard encoder applies to its tables."""
+        table = quantization.get(0)
+        if not table:
+            return 100
 
-            return "JPEG"
+        standard = sum(map(sum, JPEG_STANDARD_LUMINANCE_TABLE))
+        scale = sum(table) * 100 / standard
+        if scale <= 100:
+            quality = (200 - scale) / 2
+        else:
+            quality = 5000 / scale
+        return max(1, min(100, round(quality)))
 
     @staticmethod
-    def combine_small_images(
-        images: List[Tuple[str, bytes]],
+    def convert_image(
+        image_name: "str",
+        image_bytes: "bytes",
+        image_info: "ImageInfo",
+        encoder_profile: "EncoderProfile" = ENCODER_PROFILES[DEFAULT_ENCODER_PROFILE],
+    ) -> "Tuple[str, bytes, ImageInfo]":
+        """Convert WEBP images into a format MangaDex accepts, other images are returned as is."""
+        if image_info.format != Format.WEBP:
+            return image_name, image_bytes, image_info
+
+        new_format = ImageProcessorBase.get_new_format_for_webp(image_info)
+        with _open_image(image_bytes) as imageN:
+            output = io.BytesIO()
+            imageN.save(
+                output,
+                new_format,
+                **ImageProcessorBase.get_save_params(new_format, encoder_profile),
+            )
+            image_bytes = output.getvalue()
+            image_info = image_info._replace(
+                format=Format[new_format],
+                mode=imageN.mode,
+                frames=1,
+                size=len(image_bytes),
+            )
+        return image_name, image_bytes, image_info
+
+    @staticmethod
+    def process_image_group(
+        images: "List[Tuple[str, bytes, ImageInfo]]",
+        is_widestrip: bool,
+        parallel_threshold: int = 8,
+        encoder_profile: "EncoderProfile" = ENCODER_PROFILES[DEFAULT_ENCODER_PROFILE],
+        grayscale_tolerance: "Optional[int]" = None,
+        number_threads: "Optional[int]" = None,
+    ) -> "List[Tuple[str, bytes]]":
+        """Convert, combine and split a group planned by `plan_combine_groups` into upload ready pages.
+        Only uses its arguments, so it can run in a worker process. Split chunks are
+        encoded on up to `number_threads` threads, one per core by default."""
+        names = [image[0] for image in images]
+        images = [
+            ImageProcessorBase.convert_image(*image, encoder_profile)
+            for image in images
+        ]
+        if len(images) == 1:
+            image_name, image_bytes, image_info = images[0]
+        else:
+            image_name, image_bytes, image_info = ImageProcessorBase._composite_images(
+                images, is_widestrip, encoder_profile
+            )
+
+        split = ImageProcessorBase.split_image(
+            image_name,
+            image_bytes,
+            is_widestrip,
+            image_info,
+            parallel_threshold,
+            encoder_profile,
+            number_threads,
+        )
+        if grayscale_tolerance is not None:
+            split = [
+                ImageProcessorBase.convert_grayscale(
+                    page, grayscale_tolerance, encoder_profile
+                )
+                for page in split
+            ]
+        return ImageProcessorBase.name_pages(names, split)
+
+    @staticmethod
+    def needs_processing(
+        images: "List[Tuple[str, bytes, ImageInfo]]",
+        grayscale_tolerance: "Optional[int]" = None,
+    ) -> bool:
+        """If `process_image_group` re-encodes the group instead of returning it as is."""
+        return (
+            len(images) > 1
+            or grayscale_tolerance is not None
+            or any(
+                img[2].format == Format.WEBP
+                or img[2].width >= 10_000
+                or img[2].height >= 10_000
+                for img in images
+            )
+        )
+
+    @staticmethod
+    def is_grayscale(image: "Image.Image", tolerance: int) -> bool:
+        """Check if the colour channels of every pixel differ by at most `tolerance`.
+        Colour pages usually stop at the first band with colour in it."""
+        pixels = np.asarray(image)
+        for row in range(0, pixels.shape[0], GRAYSCALE_BAND_ROWS):
+            band = pixels[row : row + GRAYSCALE_BAND_ROWS, :, :3]
+            if np.ptp(band, axis=2).max(initial=0) > tolerance:
+                return False
+        return True
+
+    @staticmethod
+    def convert_grayscale(
+        image_bytes: "bytes",
+        tolerance: int,
+        encoder_profile: "EncoderProfile" = ENCODER_PROFILES[DEFAULT_ENCODER_PROFILE],
+    ) -> "bytes":
+        """Re-encode RGB pages without colour as grayscale, if the result is smaller.
+        Other pages are returned as is."""
+        if np is None:
+            return image_bytes
+
+        with _open_image(image_bytes) as image:
+            if (
+                image.format not in ("JPEG", "PNG")
+                or image.mode not in ("RGB", "RGBA")
+                or getattr(image, "is_animated", False)
+            ):
+                return image_bytes
+
+            image.load()
+            if not ImageProcessorBase.is_grayscale(image, tolerance):
+                return image_bytes
+
+            grayscale_bytes = ImageProcessorBase._encode_image(
+                image.convert("L" if image.mode == "RGB" else "LA"),
+                image.format,
+                **ImageProcessorBase.get_save_params(
+                    image.format, encoder_profile, image
+                ),
+            )
+
+        if len(grayscale_bytes) >= len(image_bytes):
+            return image_bytes
+        return grayscale_bytes
+
+    @staticmethod
+    def name_pages(
+        sources: "Iterable[str]", pages: "List[bytes]"
+    ) -> "List[Tuple[str, bytes]]":
+        """Name the pages made from a group of source images."""
+        group_name = "_and_".join(sources)
+        return [(f"{group_name}_{i+1}", page) for i, page in enumerate(pages)]
+
+    @staticmethod
+    def plan_combine_groups(
+        images: Iterable[Tuple[str, bytes, ImageInfo]],
         is_widestrip: bool,
         combine: bool,
         min_size: int = 128,
-    ) -> List[Tuple[str, bytes]]:
-        """Combine images that are smaller than or equal to min_size with the previous image if combine is True, otherwise skip small images."""
-        if len(images) < 2 or not combine:
-            return [
-                img
+    ) -> Iterator[List[Tuple[str, bytes, ImageInfo]]]:
+        """Group the images to combine using the header dimensions only.
+        Following small images are combined into the first image of a group."""
+        images = iter(images)
+        first_images = list(itertools.islice(images, 2))
+        images = itertools.chain(first_images, images)
+
+        if len(first_images) < 2 or not combine:
+            yield from (
+                [img]
                 for img in images
-                if ImageProcessorBase._is_image_large_enough(img[1], min_size)
-            ]
+                if ImageProcessorBase._is_image_large_enough(img[2], min_size)
+            )
+            return
 
-        combined_images = []
-        current_image = None
-        current_name = None
-        current_bytes = None
-        current_format = None
-
-        for img_name, img_bytes in images:
-            with Image.open(io.BytesIO(img_bytes)) as img:
-                width, height = img.size
-
-                if current_image is None:
-                    current_image = img.copy()
-                    current_name = img_name
-                    current_bytes = img_bytes
-                    current_format = img.format
-                elif (width <= min_size or height <= min_size) and (
-                    (is_widestrip and height == current_image.height)
-                    or (not is_widestrip and width == current_image.width)
-                ):
-                    logger.info(
-                        f"Combining {img_name} to {current_name} as {img_name} is smaller than {min_size}."
-                    )
-                    print(
-                        ImageProcessorBase.translation.get(
-                            "image_combine",
-                            "Combining {} to {} as {} is smaller than {}.",
-                        ).format(img_name, current_name, img_name, min_size)
+        group: "List[Tuple[str, bytes, ImageInfo]]" = []
+
+        for img in images:
+            img_name, _, img_info = img
+
+            if not group:
+                group.append(img)
+                continue
+
+            group_info = group[0][2]
+            if (img_info.width <= min_size or img_info.height <= min_size) and (
+                (is_widestrip and img_info.height == group_info.height)
+                or (not is_widestrip and img_info.width == group_info.width)
+            ):
+                current_name = "_and_".join(image[0] for image in group)
+                logger.info(
+                    f"Combining {img_name} to {current_name} as {img_name} is smaller than {min_size}."
+                )
+                print(
+                    ImageProcessorBase.translation.get(
+                        "image_combine",
+                        "Combining {} to {} as {} is smaller than {}.",
+                    ).format(img_name, current_name, img_name, min_size)
+                )
+                group.append(img)
+            else:
+                yield group
+                group = [img]
+
+        if group:
+            yield group
+
+    @staticmethod
+    def _composite_images(
+        images: "List[Tuple[str, bytes, ImageInfo]]",
+        is_widestrip: bool,
+        encoder_profile: "EncoderProfile" = ENCODER_PROFILES[DEFAULT_ENCODER_PROFILE],
+    ) -> "Tuple[str, bytes, ImageInfo]":
+        """Paste the images of a group one after another and encode the result once."""
+        first_info = images[0][2]
+        if is_widestrip:
+            size = (sum(img[2].width for img in images), first_info.height)
+        else:
+            size = (first_info.width, sum(img[2].height for img in images))
+
+        combined = None
+        save_params = {}
+        offset = 0
+        for _, img_bytes, img_info in images:
+            with _open_image(img_bytes) as image:
+                if combined is None:
+                    combined = Image.new(image.mode, size)
+                    save_params = ImageProcessorBase.get_save_params(
+                        first_info.format.name, encoder_profile, image
                     )
+                combined.paste(image, (offset, 0) if is_widestrip else (0, offset))
+            offset += img_info.width if is_widestrip else img_info.height
 
-                    if is_widestrip:
-                        new_width = current_image.width + img.width
-                        combined = Image.new(
-                            current_image.mode,
-                            (new_width, height),
-                        )
-                        combined.paste(current_image, (0, 0))
-                        combined.paste(img, (current_image.width, 0))
-                    else:
-                        new_height = current_image.height + img.height
-                        combined = Image.new(
-                            current_image.mode,
-                            (width, new_height),
-                        )
-                        combined.paste(current_image, (0, 0))
-                        combined.paste(img, (0, current_image.height))
+        combined_bytes = ImageProcessorBase._encode_image(
+            combined, first_info.format.name, **save_params
+        )
 
-                    current_image = combined
-                    current_name += f"_and_{img_name}"
+        return (
+            "_and_".join(img[0] for img in images),
+            combined_bytes,
+            first_info._replace(
+                width=size[0], height=size[1], size=len(combined_bytes)
+            ),
+        )
 
-                    img_byte_arr = io.BytesIO()
-                    current_image.save(img_byte_arr, format=current_format)
-                    current_bytes = img_byte_arr.getvalue()
-                else:
-                    combined_images.append((current_name, current_bytes))
-                    current_image = img.copy()
-                    current_name = img_name
-                    current_bytes = img_bytes
+    @staticmethod
+    def estimate_decoded_size(image_info: "ImageInfo") -> int:
+        """Bytes Pillow uses for the decoded image, 1, 2 or 4 bytes a pixel depending on the mode."""
+        if image_info.mode in ("1", "L", "P"):
+            pixel_size = 1
+        elif image_info.mode.startswith("I;16"):
+            pixel_size = 2
+        else:
+            pixel_size = 4
+        return image_info.width * image_info.height * pixel_size
 
-        if current_image:
-            combined_images.append((current_name, current_bytes))
-        return combined_images
+    @staticmethod
+    def estimate_group_memory(
+        images: "List[Tuple[str, bytes, ImageInfo]]",
+        is_widestrip: bool,
+        parallel_threshold: int = 8,
+        number_threads: "Optional[int]" = None,
+    ) -> int:
+        """Estimate the peak memory of `process_image_group` from the image headers.
+        `parallel_threshold` and `number_threads` are the ones it's called with."""
+        encoded_size = sum(img[2].size for img in images)
+        if len(images) > 1:
+            first_info = images[0][2]
+            if is_widestrip:
+                size = (sum(img[2].width for img in images), first_info.height)
+            else:
+                size = (first_info.width, sum(img[2].height for img in images))
+            canvas = ImageProcessorBase.estimate_decoded_size(
+                first_info._replace(width=size[0], height=size[1])
+            )
+            largest = max(
+                ImageProcessorBase.estimate_decoded_size(img[2]) for img in images
+            )
+            return canvas * 2 + largest + encoded_size * 2
+
+        image_info = images[0][2]
+        decoded = ImageProcessorBase.estimate_decoded_size(image_info)
+        if image_info.width >= 10_000 or image_info.height >= 10_000:
+            chunk_size, num_chunks, is_tall = ImageProcessorBase._get_split_layout(
+                image_info.width, image_info.height, is_widestrip
+            )
+            if is_tall and image_info.format == Format.PNG:
+                # Decoded one band at a time, inflating and decoding a band takes
+                # about four times its size, on top of the band being encoded
+                bands = 5
+                number_threads = (
+                    number_threads
+                    if number_threads is not None
+                    else os.cpu_count() or 1
+                )
+                if num_chunks > parallel_threshold and number_threads > 1:
+                    # A band for each encoding thread and the next one are waiting
+                    bands = 4 + min(num_chunks, number_threads + 1)
+                decoded = (
+                    ImageProcessorBase.estimate_decoded_size(
+                        image_info._replace(height=chunk_size)
+                    )
+                    * bands
+                )
+            else:
+                # The decoded image and the chunks cropped from it
+                decoded *= 2
+        return decoded + encoded_size * 2
+
+    @staticmethod
+    def _is_image_large_enough(image_info: "ImageInfo", min_size: int) -> bool:
+        return image_info.width > min_size and image_info.height > min_size
 
     @staticmethod
-    def _is_image_large_enough(img_bytes: bytes, min_size: int) -> bool:
-        with Image.open(io.BytesIO(img_bytes)) as img:
-            width, height = img.size
-            return width > min_size and height > min_size
+    def _get_split_layout(
+        width: int, height: int, is_widestrip: bool
+    ) -> "Tuple[int, int, bool]":
+        """Return the chunk size, number of chunks and if the image is split by height."""
+        if height >= 10_000 and is_widestrip:
+            dimension = width
+            desired_max_chunk_size = 2500
+            min_chunk_size = 1000
+            is_tall = False
+        else:
+            dimension = height
+            desired_max_chunk_size = 3000
+            min_chunk_size = 1500
+            is_tall = True
+
+        initial_num_chunks = math.ceil(dimension / desired_max_chunk_size)
+        chunk_size = math.ceil(dimension / initial_num_chunks)
+        if chunk_size < min_chunk_size:
+            chunk_size = min_chunk_size
+            num_chunks = math.ceil(dimension / chunk_size)
+        else:
+            num_chunks = initial_num_chunks
+        return chunk_size, num_chunks, is_tall
 
     @staticmethod
     def split_image(
         image_name: "str",
         image_bytes: "bytes",
         is_widestrip: bool,
+        image_info: "Optional[ImageInfo]" = None,
+        parallel_threshold: int = 8,
+        encoder_profile: "EncoderProfile" = ENCODER_PROFILES[DEFAULT_ENCODER_PROFILE],
+        number_threads: "Optional[int]" = None,
     ) -> "List[bytes]":
-        with Image.open(io.BytesIO(image_bytes)) as image:
-            width, height = image.size
+        """Split images over 10000px into chunks.
+        Chunks are encoded on `number_threads` threads if there are over `parallel_threshold` chunks.
+        """
+        if image_info is None:
+            image_info = ImageProcessorBase.probe_image(image_bytes)
 
-            if height < 10_000 and width < 10_000:
-                return [image_bytes]
+        width, height = image_info.width, image_info.height
+        if height < 10_000 and width < 10_000:
+            return [image_bytes]
 
-            split_image = []
+        chunk_size, num_chunks, is_tall = ImageProcessorBase._get_split_layout(
+            width, height, is_widestrip
+        )
 
-            if height >= 10_000 and is_widestrip:
-                dimension = width
-                desired_max_chunk_size = 2500
-                min_chunk_size = 1000
-                is_tall = False
-            else:
-                dimension = height
-                desired_max_chunk_size = 3000
-                min_chunk_size = 1500
-                is_tall = True
-
-            initial_num_chunks = math.ceil(dimension / desired_max_chunk_size)
-            chunk_size = math.ceil(dimension / initial_num_chunks)
-            if chunk_size < min_chunk_size:
-                chunk_size = min_chunk_size
-                num_chunks = math.ceil(dimension / chunk_size)
+        logger.info(
+            f"Split {'tall' if is_tall else 'wide'} image {image_name} into {num_chunks} chunks."
+        )
+        print(
+            ImageProcessorBase.translation.get(
+                "image_split", "Splitting {} into a {} image with {} chunks."
+            ).format(image_name, "tall" if is_tall else "wide", num_chunks)
+        )
+
+        parallel = num_chunks > parallel_threshold
+        if is_tall and image_info.format == Format.PNG:
+            bands = ImageProcessorBase._iter_png_bands(image_bytes, chunk_size)
+            if bands is not None:
+                logger.debug(f"Decoding {image_name} one chunk at a time.")
+                return ImageProcessorBase._encode_chunks(
+                    bands,
+                    "PNG",
+                    parallel,
+                    ImageProcessorBase.get_save_params("PNG", encoder_profile),
+                    number_threads,
+                )
+
+        with _open_image(image_bytes) as image:
+            return ImageProcessorBase._encode_chunks(
+                ImageProcessorBase._iter_crops(image, chunk_size, num_chunks, is_tall),
+                image.format,
+                parallel,
+                ImageProcessorBase.get_save_params(
+                    image.format, encoder_profile, image
+                ),
+                number_threads,
+            )
+
+    @staticmethod
+    def _iter_crops(
+        image: "Image.Image", chunk_size: int, num_chunks: int, is_tall: bool
+    ) -> "Iterator[Image.Image]":
+        width, height = image.size
+        for i in range(num_chunks):
+            if is_tall:
+                bbox = (
+                    0,
+                    i * chunk_size,
+                    width,
+                    min((i + 1) * chunk_size, height),
+                )
             else:
-                num_chunks = initial_num_chunks
+                bbox = (
+                    i * chunk_size,
+                    0,
+                    min((i + 1) * chunk_size, width),
+                    height,
+                )
+
+            yield image.crop(bbox)
 
-            logger.info(
-                f"Split {'tall' if is_tall else 'wide'} image {image_name} into {num_chunks} chunks."
+    @staticmethod
+    def _encode_image(image: "Image.Image", image_format: "str", **params) -> "bytes":
+        img_byte_arr = io.BytesIO()
+        image.save(img_byte_arr, format=image_format, **params)
+        return img_byte_arr.getvalue()
+
+    @staticmethod
+    def compress_image(
+        image_bytes: "bytes", max_size: int
+    ) -> "Optional[Tuple[bytes, str, str]]":
+        """Re-encode an image over `max_size` bytes with lossy settings until it fits.
+        PNGs are quantised to 256 colours first, then the image is saved as JPEG with
+        decreasing quality. Returns the image, its format and the settings used,
+        None if it doesn't fit or is animated."""
+        image_format = ImageProcessorBase.get_image_format(image_bytes)
+        with _open_image(image_bytes) as image:
+            if getattr(image, "is_animated", False):
+                return None
+
+            has_alpha = image.mode in ("RGBA", "LA", "PA") or (
+                "transparency" in image.info
             )
-            print(
-                ImageProcessorBase.translation.get(
-                    "image_split", "Splitting {} into a {} image with {} chunks."
-                ).format(image_name, "tall" if is_tall else "wide", num_chunks)
+            image = image.convert("RGBA" if has_alpha else "RGB")
+
+        if image_format == Format.PNG:
+            quantized = image.quantize(
+                256,
+                method=(
+                    Image.Quantize.FASTOCTREE if has_alpha else Image.Quantize.MEDIANCUT
+                ),
             )
+            compressed = ImageProcessorBase._encode_image(
+                quantized, "PNG", optimize=True
+            )
+            if len(compressed) <= max_size:
+                return compressed, "PNG", "256 colours"
+
+        if has_alpha:
+            background = Image.new("RGB", image.size, (255, 255, 255))
+            background.paste(image, mask=image.getchannel("A"))
+            image = background
+
+        for quality in JPEG_QUALITY_STEPS:
+            compressed = ImageProcessorBase._encode_image(
+                image, "JPEG", quality=quality, optimize=True
+            )
+            if len(compressed) <= max_size:
+                return compressed, "JPEG", f"quality {quality}"
+        return None
 
-            for i in range(num_chunks):
-                if is_tall:
-                    bbox = (
-                        0,
-                        i * chunk_size,
-                        width,
-                        min((i + 1) * chunk_size, height),
+    @staticmethod
+    def _encode_chunks(
+        chunks: "Iterable[Image.Image]",
+        image_format: "str",
+        parallel: bool,
+        save_params: "Optional[dict]" = None,
+        number_threads: "Optional[int]" = None,
+    ) -> "List[bytes]":
+        """Encode the chunks of a split image, keeping the chunk order.
+        Pillow's encoders release the GIL, so the chunks can be encoded on threads."""
+        save_params = save_params or {}
+        workers = number_threads if number_threads is not None else os.cpu_count() or 1
+        if not parallel or workers < 2:
+            return [
+                ImageProcessorBase._encode_image(chunk, image_format, **save_params)
+                for chunk in chunks
+            ]
+
+        encoded: "List[bytes]" = []
+        pending: "collections.deque[Future]" = collections.deque()
+        with ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="mupl-split"
+        ) as executor:
+            for chunk in chunks:
+                pending.append(
+                    executor.submit(
+                        ImageProcessorBase._encode_image,
+                        chunk,
+                        image_format,
+                        **save_params,
                     )
-                else:
-                    bbox = (
-                        i * chunk_size,
-                        0,
-                        min((i + 1) * chunk_size, width),
-                        height,
+                )
+                # Limit the decoded chunks waiting to be encoded, one for each thread
+                # and the next one
+                if len(pending) > workers:
+                    encoded.append(pending.popleft().result())
+            encoded.extend(future.result() for future in pending)
+        return encoded
+
+    @staticmethod
+    def _iter_png_chunks(
+        image_bytes: "bytes",
+    ) -> "Iterator[Tuple[bytes, memoryview, memoryview]]":
+        """Yield the type, data and the whole chunk of every PNG chunk."""
+        view = memoryview(image_bytes)
+        offset = len(PNG_SIGNATURE)
+        while offset + 8 <= len(view):
+            length, chunk_type = struct.unpack(">I4s", view[offset : offset + 8])
+            end = offset + 12 + length
+            yield chunk_type, view[offset + 8 : end - 4], view[offset:end]
+            if chunk_type == b"IEND":
+                return
+            offset = end
+
+    @staticmethod
+    def _png_chunk(chunk_type: "bytes", data: "bytes") -> "bytes":
+        return (
+            struct.pack(">I", len(data))
+            + chunk_type
+            + data
+            + struct.pack(">I", zlib.crc32(chunk_type + data))
+        )
+
+    @staticmethod
+    def strip_metadata(image_bytes: "bytes", image_format: "Format") -> "bytes":
+        """Remove the metadata of JPEG and PNG images without decoding them.
+        Colour profiles and non default EXIF orientations are kept, so the images look the same.
+        Other formats and unreadable images are returned as is."""
+        try:
+            if image_format == Format.JPEG:
+                return ImageProcessorBase._strip_jpeg_metadata(image_bytes)
+            if image_format == Format.PNG:
+                return ImageProcessorBase._strip_png_metadata(image_bytes)
+        except (struct.error, ValueError) as e:
+            logger.warning(f"Couldn't strip the image metadata: {e}")
+        return image_bytes
+
+    @staticmethod
+    def _strip_jpeg_metadata(image_bytes: "bytes") -> "bytes":
+        """Drop the COM and APPn segments, except JFIF, Adobe, ICC profiles and rotating EXIF."""
+        if image_bytes[:2] != b"\xff\xd8":
+            raise ValueError("Missing the JPEG start of image marker.")
+
+        view = memoryview(image_bytes)
+        stripped = [view[:2]]
+        offset = 2
+        while offset < len(view):
+            if view[offset] != 0xFF:
+                raise ValueError(f"Expected a JPEG marker at {offset}.")
+
+            marker = view[offset + 1]
+            if marker == 0xFF:
+                # Fill byte before the marker
+                offset += 1
+                continue
+
+            if marker == 0x01 or 0xD0 <= marker <= 0xD7:
+                stripped.append(view[offset : offset + 2])
+                offset += 2
+                continue
+
+            if marker in (0xD9, 0xDA):
+                # The rest is the entropy coded data
+                stripped.append(view[offset:])
+                break
+
+            (length,) = struct.unpack(">H", view[offset + 2 : offset + 4])
+            end = offset + 2 + length
+            if end > len(view):
+                raise ValueError("JPEG segment is longer than the image.")
+
+            segment = view[offset:end]
+            payload = bytes(segment[4:18])
+            if marker == 0xFE or 0xE1 <= marker <= 0xEF:
+                keep = (
+                    marker == 0xEE
+                    or (marker == 0xE2 and payload.startswith(b"ICC_PROFILE\x00"))
+                    or (
+                        marker == 0xE1
+                        and payload.startswith(b"Exif\x00\x00")
+                        and ImageProcessorBase._get_exif_orientation(segment[10:]) != 1
                     )
+                )
+                if not keep:
+                    offset = end
+                    continue
+
+            stripped.append(segment)
+            offset = end
+        else:
+            raise ValueError("Missing the JPEG image data.")
 
-                working_slice = image.crop(bbox)
-                img_byte_arr = io.BytesIO()
-                working_slice.save(img_byte_arr, format=image.format)
-                split_image.append(img_byte_arr.getvalue())
-            return split_image
+        return b"".join(stripped)
+
+    @staticmethod
+    def _strip_png_metadata(image_bytes: "bytes") -> "bytes":
+        """Drop the ancillary chunks that don't change how the image looks."""
+        stripped = [PNG_SIGNATURE]
+        for chunk_type, data, chunk in ImageProcessorBase._iter_png_chunks(image_bytes):
+            is_critical = chunk_type[:1].isupper()
+            if (
+                is_critical
+                or chunk_type in PNG_KEPT_CHUNKS
+                or (
+                    chunk_type == b"eXIf"
+                    and ImageProcessorBase._get_exif_orientation(data) != 1
+                )
+            ):
+                stripped.append(chunk)
+
+        if bytes(stripped[-1][4:8]) != b"IEND":
+            raise ValueError("Missing the PNG end chunk.")
+        return b"".join(stripped)
+
+    @staticmethod
+    def _get_exif_orientation(exif: "bytes") -> int:
+        """Read the orientation tag of TIFF formatted EXIF data, 1 if it's missing."""
+        exif = bytes(exif)
+        if exif[:2] == b"II":
+            byte_order = "<"
+        elif exif[:2] == b"MM":
+            byte_order = ">"
+        else:
+            return 1
+
+        try:
+            (ifd_offset,) = struct.unpack_from(f"{byte_order}I", exif, 4)
+            (entries,) = struct.unpack_from(f"{byte_order}H", exif, ifd_offset)
+            for i in range(entries):
+                tag, _, _, value = struct.unpack_from(
+                    f"{byte_order}HHI4s", exif, ifd_offset + 2 + i * 12
+                )
+                if tag == 0x0112:
+                    return struct.unpack_from(f"{byte_order}H", value)[0]
+        except struct.error:
+            pass
+        return 1
+
+    @staticmethod
+    def _read_png_band_header(
+        image_bytes: "bytes",
+    ) -> "Optional[Tuple[int, int, int, bytes, Iterator[memoryview]]]":
+        """Read the header of a PNG that can be decoded in bands, without its pixel data.
+        Returns the width, height, colour type, the chunks before the image data and
+        the image data chunks. Interlaced, animated and non 8 bit PNGs return None."""
+        if bytes(image_bytes[: len(PNG_SIGNATURE)]) != PNG_SIGNATURE:
+            return None
+
+        chunks = ImageProcessorBase._iter_png_chunks(image_bytes)
+        chunk_type, ihdr, _ = next(chunks, (None, None, None))
+        if chunk_type != b"IHDR" or len(ihdr) != 13:
+            return None
+
+        width, height, bit_depth, colour_type, _, _, interlace = struct.unpack(
+            ">IIBBBBB", ihdr
+        )
+        if bit_depth != 8 or interlace or colour_type not in PNG_CHANNELS:
+            return None
+
+        header_chunks = []
+        for chunk_type, data, chunk in chunks:
+            if chunk_type == b"IDAT":
+                first_idat = data
+                break
+            if chunk_type == b"acTL":
+                return None
+            header_chunks.append(bytes(chunk))
+        else:
+            return None
+
+        def iter_idat() -> "Iterator[memoryview]":
+            yield first_idat
+            for chunk_type, data, _ in chunks:
+                if chunk_type != b"IDAT":
+                    return
+                yield data
+
+        return width, height, colour_type, b"".join(header_chunks), iter_idat()
+
+    @staticmethod
+    def can_decode_in_bands(
+        image_bytes: "bytes",
+        image_info: "ImageInfo",
+        is_widestrip: bool,
+        max_pixels: int = MAX_IMAGE_PIXELS,
+    ) -> bool:
+        """If the image is split into chunks decoded one band at a time by `split_image`,
+        with no band over `max_pixels` pixels."""
+        if image_info.format != Format.PNG or (
+            image_info.width < 10_000 and image_info.height < 10_000
+        ):
+            return False
+
+        chunk_size, _, is_tall = ImageProcessorBase._get_split_layout(
+            image_info.width, image_info.height, is_widestrip
+        )
+        return (
+            is_tall
+            and image_info.width * chunk_size <= max_pixels
+            and ImageProcessorBase._read_png_band_header(image_bytes) is not None
+        )
+
+    @staticmethod
+    def _iter_png_bands(
+        image_bytes: "bytes", band_height: int
+    ) -> "Optional[Iterator[Image.Image]]":
+        """Decode a tall PNG in horizontal bands of `band_height` rows.
+        Only one band is decoded at a time, instead of the whole image.
+        Interlaced, animated and non 8 bit PNGs return None."""
+        header = ImageProcessorBase._read_png_band_header(image_bytes)
+        if header is None:
+            return None
+
+        width, height, colour_type, header_chunks, idat = header
+        return ImageProcessorBase._decode_png_bands(
+            idat, width, height, colour_type, header_chunks, band_height
+        )
+
+    @staticmethod
+    def _decode_png_bands(
+        idat: "Iterator[memoryview]",
+        width: int,
+        height: int,
+        colour_type: int,
+        header_chunks: "bytes",
+        band_height: int,
+    ) -> "Iterator[Image.Image]":
+        """Inflate the image data band by band and decode each band as its own PNG.
+        The last row of the previous band is added unfiltered before each band,
+        so the rows filtered against the row above them decode the same."""
+        row_length = 1 + width * PNG_CHANNELS[colour_type]
+        decompressor = zlib.decompressobj()
+        compressed = b""
+        previous_row = b""
+
+        for top in range(0, height, band_height):
+            rows = min(band_height, height - top)
+            raw = bytearray(len(previous_row) + rows * row_length)
+            raw[: len(previous_row)] = previous_row
+            filled = len(previous_row)
+            with memoryview(raw) as raw_view:
+                while filled < len(raw):
+                    if not compressed:
+                        compressed = next(idat, b"")
+                    data = decompressor.decompress(
+                        compressed, min(len(raw) - filled, PNG_INFLATE_SIZE)
+                    )
+                    if not data and not compressed:
+                        raise OSError("PNG image data is truncated.")
+                    raw_view[filled : filled + len(data)] = data
+                    filled += len(data)
+                    compressed = decompressor.unconsumed_tail
+
+            image_data = zlib.compress(raw, 0)
+            del raw
+            # Joined once, the image data is the size of the decoded band
+            band_png = b"".join(
+                (
+                    PNG_SIGNATURE,
+                    ImageProcessorBase._png_chunk(
+                        b"IHDR",
+                        struct.pack(
+                            ">IIBBBBB",
+                            width,
+                            rows + (1 if previous_row else 0),
+                            8,
+                            colour_type,
+                            0,
+                            0,
+                            0,
+                        ),
+                    ),
+                    header_chunks,
+                    struct.pack(">I", len(image_data)),
+                    b"IDAT",
+                    image_data,
+                    struct.pack(">I", zlib.crc32(image_data, zlib.crc32(b"IDAT"))),
+                    ImageProcessorBase._png_chunk(b"IEND", b""),
+                )
+            )
+            del image_data
+
+            with BufferReader(band_png) as band_file:
+                band = Image.open(band_file)
+                band.load()
+            del band_png
+
+            band_rows = band.height
+            previous_row = (
+                b"\x00" + band.crop((0, band_rows - 1, width, band_rows)).tobytes()
+            )
+            if band_rows > rows:
+                page = band.crop((0, 1, width, band_rows))
+                band.close()
+                band = page
+            yield band
+            del band
+
+
+@contextlib.contextmanager
+def _open_image(image_bytes: "Union[bytes, memoryview]") -> "Iterator[Image.Image]":
+    """Open the image with Pillow, without copying memory mapped data."""
+    with BufferReader(image_bytes) as image_file, Image.open(image_file) as image:
+        yield image
+
+
+def _init_process_worker(translation: dict):
+    """Set up a worker process of the image process pool."""
+    ImageProcessorBase.translation = translation
+
+
+def create_worker_pool(
+    number_processes: int, translation: dict, **kwargs
+) -> "WorkerPool":
+    """Worker processes set up to process images, kept between chapters.
+    `kwargs` are passed to `WorkerPool`."""
+    return WorkerPool(
+        number_processes,
+        initializer=_init_process_worker,
+        initargs=(translation,),
+        **kwargs,
+    )
+
+
+def _discard_group_result(future: "Future") -> None:
+    """Unlink the shared memory of a group whose pages won't be used."""
+    if future.cancelled() or future.exception() is not None:
+        return
+    result = future.result()
+    if isinstance(result, SharedPages):
+        result.close()
+
+
+def _process_image_group_shared(*args) -> "SharedPages":
+    """Process a group in a worker process, handing the pages back in shared memory."""
+    return SharedPages.create(ImageProcessorBase.process_image_group(*args))
 
 
 class ImageProcessor:
@@ -228,6 +1169,21 @@ class ImageProcessor:
         number_of_images_upload: int,
         widestrip: bool,
         combine: bool = False,
+        prefetch_batches: int = 2,
+        number_processes: int = 1,
+        parallel_chunks_threshold: int = 8,
+        page_cache: "Optional[PageCache]" = None,
+        max_batch_size: int = MAX_BATCH_SIZE,
+        max_session_size: int = MAX_SESSION_SIZE,
+        max_image_size: int = MAX_IMAGE_SIZE,
+        encoder_profile: str = DEFAULT_ENCODER_PROFILE,
+        strip_metadata: bool = False,
+        grayscale_tolerance: "Optional[int]" = None,
+        memory_budget: "Optional[MemoryBudget]" = None,
+        max_image_pixels: int = MAX_IMAGE_PIXELS,
+        worker_pool: "Optional[WorkerPool]" = None,
+        isolate_processing: bool = False,
+        decompress_threads: "Optional[int]" = None,
         **kwargs,
     ) -> None:
         ImageProcessorBase.translation = translation
@@ -236,104 +1192,717 @@ class ImageProcessor:
         self.combine = combine
         self.translation = translation
         self.widestrip = widestrip
+        self.prefetch_batches = max(1, prefetch_batches)
+        self.number_processes = max(1, number_processes)
+        self.parallel_chunks_threshold = max(1, parallel_chunks_threshold)
+        self.page_cache = page_cache
+        self.max_batch_size = max_batch_size
+        self.max_session_size = max_session_size
+        self.max_image_size = max_image_size
+        self.encoder_profile = ENCODER_PROFILES[encoder_profile]
+        self.strip_metadata = strip_metadata
+        self.grayscale_tolerance = grayscale_tolerance
+        self.memory_budget = (
+            memory_budget if memory_budget is not None else MemoryBudget(MEMORY_BUDGET)
+        )
+        self.max_image_pixels = max_image_pixels
+        self.worker_pool = worker_pool
+        self.decompress_threads = max(
+            1,
+            (
+                decompress_threads
+                if decompress_threads is not None
+                else os.cpu_count() or 1
+            ),
+        )
+        # Shared memory blocks of the groups, and of the pages until they're uploaded
+        self._group_pages: "Dict[Tuple[str, ...], SharedPages]" = {}
+        self._page_blocks: "Dict[int, SharedPages]" = {}
+        self._shared_pages: "List[SharedPages]" = []
+        self._shared_pages_lock = threading.Lock()
         self.myzip = None
         if not self.folder_upload:
             self.myzip = self._read_zip()
+        # Memory maps of the archive or folder files the image data is read from
+        self._mappings: "List[memoryview]" = []
+        self._archive_mapping: "Optional[memoryview]" = None
+        self._mappings_lock = threading.Lock()
 
-        self.valid_images_to_upload: "List[List[str]]" = []
-
-        self.images_to_upload_names: "Dict[str, str]" = {}
         self.converted_images: "Dict[str, str]" = {}
         self.images_upload_session = number_of_images_upload
 
-        self.info_list = self._get_valid_images()
+        self.images_to_process = self._get_images_to_process()
+        if (
+            self.worker_pool is not None
+            and not isolate_processing
+            and self._is_small_chapter(self.worker_pool.number_processes)
+        ):
+            # Not worth sending to the workers, unless decoding is kept out of this process
+            self.worker_pool = None
+        self.source_size = sum(
+            self._get_image_size(image) for image in self.images_to_process
+        )
+        self.upload_size = 0
+        self.manifest = PageManifest()
 
-    def _is_image_valid(self, image: "str") -> "Optional[List[Tuple[str, bytes]]]":
-        image_bytes = self._read_image_data(image)
-        current_format = ImageProcessorBase.get_image_format(image_bytes)
+    def _check_image_header(
+        self, image: "str", image_bytes: "Union[bytes, memoryview]"
+    ) -> "Optional[ImageInfo]":
+        """Probe the image, raising if it can't be read or is too large to process.
+        Returns None for files that aren't images."""
+        try:
+            image_info = ImageProcessorBase.probe_image(image_bytes)
+        except MuplImageTooLargeError as e:
+            print(
+                self.translation.get(
+                    "image_too_large_to_open", "{} is too large to open: {}"
+                ).format(image, e)
+            )
+            raise MuplImageTooLargeError(f"{image} is too large to open: {e}") from e
+        except MuplValidationError as e:
+            print(
+                self.translation.get("image_unreadable", "{} can't be read: {}").format(
+                    image, e
+                )
+            )
+            raise MuplValidationError(f"{image} can't be read: {e}") from e
 
-        if not current_format:
+        if not image_info:
             return None
 
-        if current_format == Format.WEBP:
-            new_format = ImageProcessorBase.get_new_format_for_webp(image_bytes)
+        if image_info.width * image_info.height > self.max_image_pixels and not (
+            ImageProcessorBase.can_decode_in_bands(
+                image_bytes, image_info, self.widestrip, self.max_image_pixels
+            )
+        ):
+            print(
+                self.translation.get(
+                    "image_too_many_pixels",
+                    "{} is {}x{}px, over the limit of {} pixels.",
+                ).format(
+                    image, image_info.width, image_info.height, self.max_image_pixels
+                )
+            )
+            raise MuplImageTooLargeError(
+                f"{image} is {image_info.width}x{image_info.height}px, over the limit of {self.max_image_pixels} pixels."
+            )
+        return image_info
+
+    def _is_image_valid(
+        self, image: "str", image_bytes: "Union[bytes, memoryview]"
+    ) -> "Optional[Tuple[str, bytes, ImageInfo]]":
+        image_info = self._check_image_header(image, image_bytes)
+        if not image_info:
+            return None
+
+        if self.strip_metadata:
+            stripped_bytes = ImageProcessorBase.strip_metadata(
+                image_bytes, image_info.format
+            )
+            if len(stripped_bytes) < len(image_bytes):
+                logger.debug(
+                    f"Stripped {len(image_bytes) - len(stripped_bytes)} bytes of metadata from {image}."
+                )
+                image_bytes = stripped_bytes
+                image_info = image_info._replace(size=len(image_bytes))
+
+        if image_info.format == Format.WEBP:
+            new_format = ImageProcessorBase.get_new_format_for_webp(image_info)
             self.converted_images.update({image: new_format})
-            logger.info(f"Converted {image} into {new_format}")
-            with Image.open(io.BytesIO(image_bytes)) as imageN:
-                output = io.BytesIO()
-                imageN.save(output, new_format)
-                image_bytes = output.getvalue()
+            logger.info(f"Converting {image} into {new_format}")
 
-        return [(image, image_bytes)]
+        return image, image_bytes, image_info
 
-    def _read_image_data(self, image: "str") -> "bytes":
-        """Read the image data from the zip or from the folder."""
+    def _read_image_data(self, image: "str") -> "Union[bytes, memoryview]":
+        """Read the image data from the zip or from the folder.
+        Folder files and stored zip members are memory mapped instead of copied."""
         if self.folder_upload:
             image_path = self.to_upload.joinpath(image)
+            image_view = self._map_file(image_path)
+            if image_view is not None:
+                return image_view
             return image_path.read_bytes()
-        else:
-            with self.myzip.open(image) as myfile:
-                return myfile.read()
+
+        zip_info = self.myzip.getinfo(image)
+        # Encrypted members are flagged by the first bit
+        if zip_info.compress_type == zipfile.ZIP_STORED and not zip_info.flag_bits & 1:
+            image_view = self._map_stored_member(zip_info)
+            if image_view is not None:
+                return image_view
+
+        with self.myzip.open(image) as myfile:
+            return myfile.read()
+
+    def _map_file(self, path: "Path") -> "Optional[memoryview]":
+        """Memory map a file read only, None if it can't be mapped."""
+        try:
+            with open(path, "rb") as file:
+                mapping = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError) as e:
+            # Empty files can't be mapped
+            logger.debug(f"Couldn't memory map {path}: {e}")
+            return None
+
+        view = memoryview(mapping)
+        with self._mappings_lock:
+            self._mappings.append(view)
+        return view
+
+    def _map_stored_member(self, zip_info: "zipfile.ZipInfo") -> "Optional[memoryview]":
+        """Return the data of an uncompressed zip member as a slice of the mapped archive."""
+        with self._mappings_lock:
+            archive = self._archive_mapping
+        if archive is None:
+            archive = self._map_file(self.to_upload)
+            if archive is None:
+                return None
+            with self._mappings_lock:
+                self._archive_mapping = archive
+
+        # The local header's extra field can differ from the central directory's
+        header_start = zip_info.header_offset
+        header = archive[header_start : header_start + 30]
+        if len(header) != 30 or header[:4] != b"PK\x03\x04":
+            return None
+
+        name_length, extra_length = struct.unpack("<HH", header[26:30])
+        data_start = header_start + 30 + name_length + extra_length
+        data_end = data_start + zip_info.compress_size
+        if data_end > len(archive):
+            return None
+        return archive[data_start:data_end]
+
+    def close_mappings(self) -> None:
+        """Unmap the archive and folder files, image data read from them is invalid after this."""
+        with self._mappings_lock:
+            mappings, self._mappings = self._mappings, []
+            self._archive_mapping = None
+
+        for view in mappings:
+            mapping = view.obj
+            try:
+                view.release()
+                mapping.close()
+            except BufferError:
+                # Pages still refer to it, it's unmapped once they are collected
+                logger.debug("Memory mapped image data is still in use.")
+
+    def _get_image_size(self, image: "str") -> int:
+        """Size of the file in the zip or folder, without reading it."""
+        if self.folder_upload:
+            return self.to_upload.joinpath(image).stat().st_size
+        return self.myzip.getinfo(image).file_size
 
     def _read_zip(self) -> "zipfile.ZipFile":
         """Open zip file in read only mode."""
         return zipfile.ZipFile(self.to_upload)
 
-    def _get_valid_images(self):
-        """Validate the files in the archive.
-        Check if all the files are images.
-        Sorts the images using natural sort."""
+    def _get_images_to_process(self) -> "List[str]":
+        """List the files in the archive or folder.
+        Sorts the files using natural sort, no file data is read."""
         if self.folder_upload:
-            to_iter = [x.name for x in self.to_upload.iterdir()]
+            to_iter = [x.name for x in self.to_upload.iterdir() if x.is_file()]
         else:
-            to_iter = [x.filename for x in self.myzip.infolist()]
+            to_iter = [x.filename for x in self.myzip.infolist() if not x.is_dir()]
+
+        return natsort.natsorted(to_iter, key=ImageProcessorBase.key)
+
+    def _iter_image_data(self) -> "Iterator[Tuple[str, Union[bytes, memoryview]]]":
+        """Read the files in order.
+        Compressed zip members are decompressed on several threads ahead of the one read.
+        """
+        compressed_images = []
+        if not self.folder_upload and self.decompress_threads > 1:
+            compressed_images = [
+                image
+                for image in self.images_to_process
+                if self.myzip.getinfo(image).compress_type != zipfile.ZIP_STORED
+            ]
+
+        if len(compressed_images) < 2:
+            for image in self.images_to_process:
+                yield image, self._read_image_data(image)
+            return
+
+        zip_reader = ParallelZipReader(self.to_upload, self.decompress_threads)
+        # Members are decompressed in the same order as the images to process
+        members = zip_reader.iter_members(compressed_images)
+        compressed_images = set(compressed_images)
+        try:
+            for image in self.images_to_process:
+                if image in compressed_images:
+                    yield next(members)
+                else:
+                    yield image, self._read_image_data(image)
+        finally:
+            members.close()
+            zip_reader.close()
 
-        processed_images: List[Tuple[str, bytes]] = []
-        for image in to_iter:
-            image_valid = self._is_image_valid(image)
-            if image_valid:
-                processed_images.extend(image_valid)
+    def _iter_valid_images(self) -> "Iterator[Tuple[str, bytes, ImageInfo]]":
+        """Validate the files in the archive.
+        Check if all the files are images, each file is only read when it is reached."""
+        image_data = self._iter_image_data()
+        try:
+            for image, image_bytes in image_data:
+                image_valid = self._is_image_valid(image, image_bytes)
+                if image_valid:
+                    yield image_valid
+        finally:
+            image_data.close()
 
-        processed_images = ImageProcessorBase.combine_small_images(
-            processed_images, self.widestrip, self.combine
+    def _is_small_chapter(self, number_processes: int) -> bool:
+        """Worker processes are only worth using for chapters with enough images."""
+        return number_processes < 2 or len(self.images_to_process) < max(
+            MIN_IMAGES_PROCESS_POOL, number_processes
         )
 
-        split_images: List[Tuple[str, bytes]] = []
-        for image_name, image_bytes in processed_images:
-            split = ImageProcessorBase.split_image(
-                image_name,
-                image_bytes,
-                self.widestrip,
+    def _create_process_pool(self) -> "Optional[ProcessPoolExecutor]":
+        if self._is_small_chapter(self.number_processes):
+            return None
+
+        logger.debug(f"Processing images using {self.number_processes} processes.")
+        return ProcessPoolExecutor(
+            max_workers=self.number_processes,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_process_worker,
+            initargs=(self.translation,),
+        )
+
+    def _get_cache_key(
+        self, group: "List[Tuple[str, bytes, ImageInfo]]"
+    ) -> "Optional[str]":
+        """Key of the group's pages in the cache, None if the group isn't cached.
+        Groups uploaded as they are don't need any pixel work, so they aren't cached."""
+        if self.page_cache is None or not ImageProcessorBase.needs_processing(
+            group, self.grayscale_tolerance
+        ):
+            return None
+
+        target_formats = tuple(
+            (
+                ImageProcessorBase.get_new_format_for_webp(img[2])
+                if img[2].format == Format.WEBP
+                else img[2].format.name
             )
-            if split:
-                split_images.extend(
-                    (f"{image_name}_{i+1}", img) for i, img in enumerate(split)
+            for img in group
+        )
+        return PageCache.make_key(
+            (img[1] for img in group),
+            self.widestrip,
+            self.combine,
+            target_formats,
+            tuple(self.encoder_profile),
+            self.grayscale_tolerance,
+        )
+
+    def _finish_group(
+        self,
+        sources: "Tuple[str, ...]",
+        cache_key: "Optional[str]",
+        pages: "Union[Future, List[Tuple[str, bytes]]]",
+        reserved_memory: int = 0,
+    ) -> "Tuple[Tuple[str, ...], List[Tuple[str, bytes]]]":
+        if isinstance(pages, Future):
+            try:
+                pages = (
+                    self.worker_pool.result(pages)
+                    if self.worker_pool is not None
+                    else pages.result()
                 )
+            except (BrokenProcessPool, MuplProcessingTimeoutError):
+                # The workers died, the blocks they made are never returned
+                SharedPages.unlink_orphans()
+                raise
+            finally:
+                self.memory_budget.release(reserved_memory)
 
-        info_list_images_only = natsort.natsorted(
-            split_images, key=ImageProcessorBase.key
+            if isinstance(pages, SharedPages):
+                shared_pages = pages
+                with self._shared_pages_lock:
+                    self._shared_pages.append(shared_pages)
+                    self._group_pages[sources] = shared_pages
+                pages = shared_pages.attach()
+        if cache_key is not None:
+            self.page_cache.put(cache_key, [page[1] for page in pages])
+        return sources, pages
+
+    def _iter_processed_groups(
+        self,
+    ) -> "Iterator[Tuple[Tuple[str, ...], List[Tuple[str, bytes]]]]":
+        """Yield the source image names and upload ready pages of each group in order.
+        Cached groups are reused without any pixel work."""
+        groups = ImageProcessorBase.plan_combine_groups(
+            self._iter_valid_images(), self.widestrip, self.combine
         )
 
-        self.valid_images_to_upload = [
-            info_list_images_only[l : l + self.images_upload_session]
-            for l in range(0, len(info_list_images_only), self.images_upload_session)
-        ]
+        if self.worker_pool is not None:
+            executor = self.worker_pool
+            number_processes = self.worker_pool.number_processes
+        else:
+            executor = self._create_process_pool()
+            number_processes = self.number_processes
+        # Keep a few groups queued per process so results are yielded in order
+        # without holding the whole chapter
+        max_pending = 1 if executor is None else number_processes * 2
+        # Workers share the cores, so each encodes its chunks on its share of them
+        encode_threads = (
+            None
+            if executor is None
+            else max(1, (os.cpu_count() or 1) // number_processes)
+        )
+        pending: "collections.deque" = collections.deque()
+        try:
+            for group in groups:
+                sources = tuple(img[0] for img in group)
+                cache_key = self._get_cache_key(group)
+                cached_pages = (
+                    self.page_cache.get(cache_key) if cache_key is not None else None
+                )
+
+                if not ImageProcessorBase.needs_processing(
+                    group, self.grayscale_tolerance
+                ):
+                    # Uploaded as it is, the workers would have nothing to do
+                    pending.append(
+                        (
+                            sources,
+                            None,
+                            ImageProcessorBase.name_pages(sources, [group[0][1]]),
+                        )
+                    )
+                elif cached_pages is not None:
+                    logger.debug(f"Using cached pages for {sources}.")
+                    pending.append(
+                        (
+                            sources,
+                            None,
+                            ImageProcessorBase.name_pages(sources, cached_pages),
+                        )
+                    )
+                else:
+                    # Wait for the queued groups to free memory before decoding more
+                    estimate = ImageProcessorBase.estimate_group_memory(
+                        group,
+                        self.widestrip,
+                        self.parallel_chunks_threshold,
+                        encode_threads,
+                    )
+                    while pending and not self.memory_budget.try_acquire(estimate):
+                        yield self._finish_group(*pending.popleft())
+                    if not pending:
+                        self.memory_budget.acquire(estimate)
+
+                    try:
+                        if executor is not None:
+                            # Memory mapped image data can't be pickled
+                            group = [
+                                (name, bytes(data), info) for name, data, info in group
+                            ]
+
+                        process_function = (
+                            _process_image_group_shared
+                            if SHARED_MEMORY_SUPPORTED
+                            else ImageProcessorBase.process_image_group
+                        )
+                        args = (
+                            group,
+                            self.widestrip,
+                            self.parallel_chunks_threshold,
+                            self.encoder_profile,
+                            self.grayscale_tolerance,
+                            encode_threads,
+                        )
+                        if executor is None:
+                            pages = ImageProcessorBase.process_image_group(*args)
+                        elif self.worker_pool is not None:
+                            future = self.worker_pool.submit(
+                                process_function,
+                                *args,
+                                size=sum(img[2].size for img in group),
+                            )
+                        else:
+                            future = executor.submit(process_function, *args)
+                    except BaseException:
+                        # The group isn't queued, nothing else would release its memory
+                        self.memory_budget.release(estimate)
+                        raise
+
+                    if executor is None:
+                        self.memory_budget.release(estimate)
+                        pending.append((sources, cache_key, pages))
+                    else:
+                        pending.append((sources, cache_key, future, estimate))
+
+                if len(pending) >= max_pending:
+                    yield self._finish_group(*pending.popleft())
+
+            while pending:
+                yield self._finish_group(*pending.popleft())
+        finally:
+            for entry in pending:
+                if len(entry) == 4:
+                    # Groups that are running or done still hold a shared memory block
+                    if not entry[2].cancel():
+                        entry[2].add_done_callback(_discard_group_result)
+                    self.memory_budget.release(entry[3])
+
+            if self.worker_pool is not None:
+                self.worker_pool.finish_chapter()
+            elif executor is not None:
+                executor.shutdown(wait=True, cancel_futures=True)
+
+    def _iter_batches(self) -> "Iterator[List[Page]]":
+        """Number the pages and pack them into batches.
+        A batch has at most `images_upload_session` pages and `max_batch_size` bytes."""
+        batch: "List[Page]" = []
+        batch_size = 0
+        for sources, pages in self._iter_processed_groups():
+            with self._shared_pages_lock:
+                shared_pages = self._group_pages.pop(sources, None)
+            for page_name, page_bytes in pages:
+                converted_format = self.converted_images.get(sources[0])
+                if len(page_bytes) > self.max_image_size:
+                    page_bytes, converted_format = self._compress_page(
+                        page_name, page_bytes
+                    )
+
+                self.upload_size += len(page_bytes)
+                if self.upload_size > self.max_session_size:
+                    raise MuplUploadSessionError(
+                        f"{self.to_upload.name} is over the upload session limit of {self.max_session_size} bytes."
+                    )
+
+                if batch and batch_size + len(page_bytes) > self.max_batch_size:
+                    logger.debug(f"Images to upload: {[img.name for img in batch]}")
+                    yield batch
+                    batch = []
+                    batch_size = 0
+
+                ordinal = self.manifest.add(page_name, sources[0], converted_format)
+                if shared_pages is not None:
+                    with self._shared_pages_lock:
+                        self._page_blocks[ordinal] = shared_pages
+                batch.append(Page(ordinal, page_name, page_bytes))
+                batch_size += len(page_bytes)
+
+                if len(batch) == self.images_upload_session:
+                    logger.debug(f"Images to upload: {[img.name for img in batch]}")
+                    yield batch
+                    batch = []
+                    batch_size = 0
+
+        if batch:
+            logger.debug(f"Images to upload: {[img.name for img in batch]}")
+            yield batch
+
+    def _compress_page(
+        self, page_name: "str", page_bytes: "bytes"
+    ) -> "Tuple[bytes, str]":
+        """Compress a page over the file size limit, raises if it can't fit."""
+        size_mb = round(len(page_bytes) / (1024 * 1024), 2)
+        max_size_mb = round(self.max_image_size / (1024 * 1024), 2)
+        compressed = ImageProcessorBase.compress_image(page_bytes, self.max_image_size)
+        if compressed is None:
+            print(
+                self.translation.get(
+                    "image_too_large",
+                    "{} is {} mb and couldn't be compressed under the {} mb file limit.",
+                ).format(page_name, size_mb, max_size_mb)
+            )
+            raise MuplUploadSessionError(
+                f"{page_name} is {len(page_bytes)} bytes and couldn't be compressed under {self.max_image_size} bytes."
+            )
+
+        compressed_bytes, image_format, settings = compressed
+        logger.warning(
+            f"{page_name} was {len(page_bytes)} bytes, lossily compressed to {len(compressed_bytes)} bytes as {image_format} ({settings})."
+        )
+        print(
+            self.translation.get(
+                "image_compressed",
+                "{} is {} mb, over the {} mb file limit. Lossily compressed to {} mb as {} ({}).",
+            ).format(
+                page_name,
+                size_mb,
+                max_size_mb,
+                round(len(compressed_bytes) / (1024 * 1024), 2),
+                image_format,
+                settings,
+            )
+        )
+        return compressed_bytes, image_format
+
+    def check_images(self) -> None:
+        """Read the header of every image before the upload session is created.
+        Raises for the first image that can't be read or is too large to process."""
+        for image in self.images_to_process:
+            self._check_image_header(image, self._read_image_header(image))
+
+    def _read_image_header(self, image: "str") -> "Union[bytes, memoryview]":
+        """Read enough of the image to probe its header.
+        Compressed zip members are only decompressed as far as the header, the whole
+        member is read if the header isn't in that part or the image is over the
+        pixel limit, so `_check_image_header` sees the same as with all the data."""
+        if self.folder_upload:
+            return self._read_image_data(image)
+
+        zip_info = self.myzip.getinfo(image)
+        if zip_info.compress_type == zipfile.ZIP_STORED and not zip_info.flag_bits & 1:
+            return self._read_image_data(image)
+
+        with self.myzip.open(image) as myfile:
+            header = myfile.read(IMAGE_HEADER_SIZE)
+            if len(header) < IMAGE_HEADER_SIZE:
+                return header
+
+            try:
+                image_info = ImageProcessorBase.probe_image(header)
+            except MuplValidationError:
+                return header + myfile.read()
+
+            if (
+                image_info is None
+                or image_info.width * image_info.height <= self.max_image_pixels
+            ):
+                return header
+            return header + myfile.read()
+
+    def fits_upload_session(self) -> bool:
+        """Check the size of the files against the upload session limit, before processing them."""
+        return self.source_size <= self.max_session_size
+
+    def _produce_batches(self, batches: "queue.Queue", stop: "threading.Event"):
+        """Fill the queue with batches until all the pages are processed or stopped."""
+
+        def put(item) -> bool:
+            while not stop.is_set():
+                try:
+                    batches.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        try:
+            for batch in self._iter_batches():
+                if not put(batch):
+                    return
+        except Exception as e:
+            logger.exception(f"Couldn't process the images of {self.to_upload}: {e}")
+            put(e)
+            return
+        put(None)
+
+    def _verify_image(self, image: "str") -> "Optional[str]":
+        """Read the image, checking the zip CRC, and decode all of its frames.
+        Returns why the image is corrupt, None if it's fine or not an image."""
+        try:
+            image_bytes = self._read_image_data(image)
+            image_info = ImageProcessorBase.probe_image(image_bytes)
+        except (zipfile.BadZipFile, OSError, MuplValidationError) as e:
+            return str(e)
+
+        # Memory mapped zip members aren't checked while reading them
+        if not self.folder_upload and isinstance(image_bytes, memoryview):
+            if zlib.crc32(image_bytes) != self.myzip.getinfo(image).CRC:
+                return f"Bad CRC-32 for file '{image}'"
+
+        if image_info is None:
+            return None
+
+        bands = None
+        if ImageProcessorBase.can_decode_in_bands(
+            image_bytes, image_info, self.widestrip, self.max_image_pixels
+        ):
+            chunk_size, _, _ = ImageProcessorBase._get_split_layout(
+                image_info.width, image_info.height, self.widestrip
+            )
+            bands = ImageProcessorBase._iter_png_bands(image_bytes, chunk_size)
+            image_info = image_info._replace(height=chunk_size)
+
+        estimate = ImageProcessorBase.estimate_decoded_size(image_info)
+        self.memory_budget.acquire(estimate)
+        try:
+            if bands is not None:
+                for band in bands:
+                    band.close()
+            else:
+                with _open_image(image_bytes) as decoded:
+                    for frame in range(image_info.frames):
+                        decoded.seek(frame)
+                        decoded.load()
+        except Exception as e:
+            return f"{type(e).__name__}: {e}"
+        finally:
+            self.memory_budget.release(estimate)
+        return None
+
+    def verify_images(self) -> "Dict[str, Optional[str]]":
+        """Fully decode every image on a thread per core, before anything is uploaded.
+        Returns the error of every image in order, None for the images that are fine."""
+        workers = min(os.cpu_count() or 1, max(1, len(self.images_to_process)))
+        with ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="mupl-verify"
+        ) as executor:
+            errors = executor.map(self._verify_image, self.images_to_process)
+            report = dict(zip(self.images_to_process, errors))
+
+        for image, error in report.items():
+            if error is None:
+                logger.debug(f"Verified {image}.")
+            else:
+                logger.error(f"{image} is corrupt: {error}")
+        return report
+
+    def iter_batches(self) -> "Iterator[List[Page]]":
+        """Yield the upload batches in page order.
+        The next `prefetch_batches` batches are read and processed in the background
+        while the current batch is uploading, only those batches are kept in memory."""
+        batches: "queue.Queue" = queue.Queue(maxsize=self.prefetch_batches)
+        stop = threading.Event()
+        producer = threading.Thread(
+            target=self._produce_batches,
+            args=(batches, stop),
+            name="mupl-images",
+            daemon=True,
+        )
+        producer.start()
 
-        logger.debug(f"Images to upload: {[img[0] for img in info_list_images_only]}")
-        return info_list_images_only
+        try:
+            while True:
+                batch = batches.get()
+                if batch is None:
+                    return
+                if isinstance(batch, Exception):
+                    raise batch
+                yield batch
+        finally:
+            stop.set()
+            producer.join()
 
-    def get_images_to_upload(
-        self, images_to_read: "List[Tuple[str, bytes]]"
-    ) -> "Dict[str, bytes]":
-        """Read the image data from the zip as list."""
-        logger.debug(f"Reading data for images: {[img[0] for img in images_to_read]}")
+    @property
+    def number_of_pages(self) -> int:
+        """Number of pages processed so far."""
+        return len(self.manifest)
 
-        files: "Dict[str, bytes]" = {}
-        for array_index, image in enumerate(images_to_read, start=1):
-            image_filename = str(Path(image[0]).name)
+    def release_pages(self, pages: "List[Page]") -> None:
+        """Free the shared memory of uploaded pages, they can't be read after this."""
+        with self._shared_pages_lock:
+            blocks = [self._page_blocks.pop(page.ordinal, None) for page in pages]
+        for shared_pages in blocks:
+            if shared_pages is not None:
+                shared_pages.release()
 
-            renamed_file = str(self.info_list.index(image))
+    def release_all_pages(self) -> None:
+        """Free the shared memory of every page, once the chapter is done or failed."""
+        with self._shared_pages_lock:
+            blocks, self._shared_pages = self._shared_pages, []
+            self._group_pages.clear()
+            self._page_blocks.clear()
+        for shared_pages in blocks:
+            shared_pages.close()
 
-            self.images_to_upload_names.update({renamed_file: image_filename})
-            files.update({renamed_file: image[1]})
-        return files
+    def get_images_to_upload(self, images_to_read: "List[Page]") -> "Dict[str, bytes]":
+        """Map the batch's page data to the page ordinals used as upload file names."""
+        logger.debug(f"Reading data for images: {[img.name for img in images_to_read]}")
+        return {str(page.ordinal): page.data for page in images_to_read}
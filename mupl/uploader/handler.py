@@ -7,6 +7,7 @@ from mupl.exceptions import MuplUploadSessionError
 from mupl.http import RequestError
 from mupl.http.client import HTTPClient
 from mupl.image_validator import ImageProcessor
+from mupl.uploader.page_order import PageOrder
 
 
 logger = logging.getLogger("mupl")
@@ -52,7 +53,6 @@ class ChapterUploaderHandler:
 
         self.md_upload_api_url = f"{self.mangadex_api_url}/upload"
 
-        self.images_to_upload_ids: "List[str]" = []
         self.upload_session_id: "Optional[str]" = None
         self.failed_image_upload = False
 
@@ -65,6 +65,22 @@ class ChapterUploaderHandler:
             combine=self.combine,
             **kwargs,
         )
+        self.page_order = PageOrder()
+        self.tqdm = None
+
+    def _iter_upload_batches(self):
+        """Yield the processed image batches, reserving the page order slots for each batch.
+        Stops and marks the upload as failed if the images couldn't be processed."""
+        try:
+            for images_array in self.image_uploader_process.iter_batches():
+                self.page_order.reserve(images_array[-1].ordinal + 1)
+                if self.tqdm is not None:
+                    self.tqdm.total = len(self.page_order)
+                    self.tqdm.refresh()
+                yield images_array
+        except Exception as e:
+            logger.error(f"Stopped processing the images of {self.zip_name}: {e}")
+            self.failed_image_upload = True
 
     def _images_upload(self, image_batch: "Dict[str, bytes]"):
         """Upload the images"""
@@ -133,18 +149,12 @@ class ChapterUploaderHandler:
                 uploaded_filename = uploaded_image_attributes["originalFileName"]
                 file_size = uploaded_image_attributes["fileSize"]
 
-                self.images_to_upload_ids.insert(
-                    int(uploaded_filename), uploaded_image["id"]
-                )
-                original_filename = self.image_uploader_process.images_to_upload_names[
-                    uploaded_filename
-                ]
-                converted_format = self.image_uploader_process.converted_images.get(
-                    original_filename
-                )
-                formatted_name_message = original_filename
-                if converted_format is not None:
-                    formatted_name_message += f" (converted to {converted_format})"
+                page_ordinal = int(uploaded_filename)
+                self.page_order.set(page_ordinal, uploaded_image["id"])
+                page = self.image_uploader_process.manifest[page_ordinal]
+                formatted_name_message = Path(page.name).name
+                if page.converted_format is not None:
+                    formatted_name_message += f" (converted to {page.converted_format})"
 
                 if self.verbose:
                     print(
@@ -244,6 +254,24 @@ class ChapterUploaderHandler:
 
     def _commit_chapter(self) -> "bool":
         """Try commit the chapter to mangadex."""
+        self.page_order.reserve(self.image_uploader_process.number_of_pages)
+        missing_pages = self.page_order.missing()
+        if missing_pages:
+            logger.error(
+                f"Pages {[page + 1 for page in missing_pages]} of {self.zip_name} have no uploaded id, removing upload draft."
+            )
+            print(
+                self.translation.get(
+                    "missing_pages_commit",
+                    "Pages {} weren't uploaded, not committing {}.",
+                ).format(
+                    ", ".join(str(page + 1) for page in missing_pages), self.zip_name
+                )
+            )
+            self.remove_upload_session()
+            self.failed_uploads.append(self.to_upload)
+            return False
+
         payload = {
             "chapterDraft": {
                 "volume": self.file_name_obj.volume_number,
@@ -252,7 +280,7 @@ class ChapterUploaderHandler:
                 "translatedLanguage": self.file_name_obj.language,
             },
             "termsAccepted": self.http_client.upload_terms_accepted,
-            "pageOrder": self.images_to_upload_ids,
+            "pageOrder": self.page_order.to_list(),
         }
 
         if self.file_name_obj.publish_date is not None:
@@ -277,6 +305,8 @@ class ChapterUploaderHandler:
                 )
 
                 if self.move_files_after_upload:
+                    # Mapped files can't be moved on Windows
+                    self.image_uploader_process.close_mappings()
                     self.move_files()
                 return True
 
@@ -0,0 +1,54 @@
+import logging
+import threading
+from typing import List, Optional
+
+logger = logging.getLogger("mupl")
+
+
+class PageOrder:
+    """Uploaded page ids kept in page order.
+
+    Every page has a preallocated slot indexed by its ordinal, slots are filled
+    as the upload responses come in, so batches can complete in any order."""
+
+    def __init__(self, total: int = 0) -> None:
+        self._slots: "List[Optional[str]]" = [None] * total
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def reserve(self, total: int) -> None:
+        """Grow the slots to hold at least `total` pages."""
+        with self._lock:
+            if total > len(self._slots):
+                self._slots.extend([None] * (total - len(self._slots)))
+
+    def set(self, ordinal: int, page_id: str) -> None:
+        """Store the uploaded page id for the page ordinal."""
+        with self._lock:
+            if not 0 <= ordinal < len(self._slots):
+                raise IndexError(
+                    f"Page ordinal {ordinal} is outside of the {len(self._slots)} pages."
+                )
+
+            existing_id = self._slots[ordinal]
+            if existing_id is not None and existing_id != page_id:
+                logger.warning(
+                    f"Page {ordinal} was uploaded again, replacing {existing_id} with {page_id}."
+                )
+            self._slots[ordinal] = page_id
+
+    def missing(self) -> "List[int]":
+        """Return the ordinals of the pages without an uploaded id."""
+        with self._lock:
+            return [
+                ordinal
+                for ordinal, page_id in enumerate(self._slots)
+                if page_id is None
+            ]
+
+    def to_list(self) -> "List[str]":
+        """Return the page ids in page order."""
+        with self._lock:
+            return list(self._slots)
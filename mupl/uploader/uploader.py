@@ -1,12 +1,13 @@
+import itertools
 import os
 import shutil
-import time
-import asyncio
 import logging
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from pathlib import Path
 
 from tqdm import tqdm
 
+from mupl.exceptions import MuplValidationError
 from mupl.file_validator import FileProcesser
 from mupl.http.client import HTTPClient
 from mupl.uploader.handler import ChapterUploaderHandler
@@ -55,6 +56,7 @@ class ChapterUploader(ChapterUploaderHandler):
         self.uploaded_files = uploaded_files
         self.ratelimit_time = ratelimit_time
         self.threaded = kwargs.get("threaded", False)
+        self.verify_images = kwargs.get("verify_images", False)
         if self.number_threads <= 1:
             self.threaded = False
 
@@ -69,19 +71,6 @@ class ChapterUploader(ChapterUploaderHandler):
         self.ratelimit_time = self.ratelimit_time
         self.myzip = self.image_uploader_process.myzip
 
-    @staticmethod
-    def create_new_event_loop():
-        """Return the event loop, create one if not there is not one running."""
-        try:
-            return asyncio.get_event_loop()
-        except RuntimeError as e:
-            if str(e).startswith("There is no current event loop in thread"):
-                loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(loop)
-                return loop
-            else:
-                raise
-
     def move_files(self):
         """Move the uploaded chapters to a different folder."""
         self.uploaded_files_path.mkdir(parents=True, exist_ok=True)
@@ -116,41 +105,62 @@ class ChapterUploader(ChapterUploaderHandler):
         )
         logger.debug(f"Moved '{self.to_upload}' to '{new_uploaded_zip_path}'")
 
-    async def process_images_upload(self, images_array):
-        """Start uploading the images, threaded."""
+    def process_images_upload(self, images_array) -> "bool":
+        """Upload a single batch of images, returns True if the batch failed."""
         images_to_upload = self.image_uploader_process.get_images_to_upload(
             images_array
         )
-        failed = self._upload_images(images_to_upload)
-        if failed:
-            self.failed_image_upload = True
-            asyncio.get_running_loop().close()
-
-    def run_threaded_uploader(self, spliced_images):
-        """Run the threads for upload."""
-        tasks = []
-
-        loop = self.create_new_event_loop()
-        for images_to_upload in spliced_images:
-            task = self.process_images_upload(images_to_upload)
-            tasks.append(task)
-
-        gathered = asyncio.gather(*tasks)
-
         try:
-            loop.run_until_complete(gathered)
-        except KeyboardInterrupt as e:
-            print(self.translation["keyboard_interrupt_cancel"])
-            gathered.cancel()
-            self.failed_image_upload = True
+            return self._upload_images(images_to_upload)
+        finally:
+            self.image_uploader_process.release_pages(images_array)
+
+    def run_threaded_uploader(self, images):
+        """Upload the image batches concurrently.
+        Keeps up to `number_threads` batches in flight, a new batch is started
+        as soon as one finishes. No new batches are started after a failure."""
+        batches = iter(images)
+        in_flight = set()
+
+        with ThreadPoolExecutor(
+            max_workers=self.number_threads, thread_name_prefix="mupl-upload"
+        ) as executor:
+            try:
+                while True:
+                    while (
+                        not self.failed_image_upload
+                        and len(in_flight) < self.number_threads
+                    ):
+                        images_array = next(batches, None)
+                        if images_array is None:
+                            break
+                        in_flight.add(
+                            executor.submit(self.process_images_upload, images_array)
+                        )
+
+                    if not in_flight:
+                        break
+
+                    done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        try:
+                            failed = future.result()
+                        except Exception as e:
+                            logger.exception(f"Image batch upload errored: {e}")
+                            failed = True
+
+                        if failed:
+                            self.failed_image_upload = True
+            except KeyboardInterrupt:
+                print(self.translation["keyboard_interrupt_cancel"])
+                for future in in_flight:
+                    future.cancel()
+                self.failed_image_upload = True
 
     def run_image_uploader(self, images):
         """Run the image mupl ."""
         for images_array in images:
-            images_to_upload = self.image_uploader_process.get_images_to_upload(
-                images_array
-            )
-            failed = self._upload_images(images_to_upload)
+            failed = self.process_images_upload(images_array)
             if failed:
                 self.failed_image_upload = True
 
@@ -203,11 +213,83 @@ class ChapterUploader(ChapterUploaderHandler):
             )
         )
 
-        if not self.image_uploader_process.valid_images_to_upload:
+        image_batches = self._iter_upload_batches()
+        try:
+            return self._upload_batches(image_batches)
+        finally:
+            # Already closed before the commit, unless the upload stopped on an error
+            self._close_chapter_files(image_batches)
+
+    def _close_chapter_files(self, image_batches) -> None:
+        """Stop processing the chapter and close its files, so they can be moved."""
+        image_batches.close()
+        self.image_uploader_process.release_all_pages()
+        self.image_uploader_process.close_mappings()
+        if not self.folder_upload:
+            self.myzip.close()
+
+    def _verify_images(self) -> "bool":
+        """Decode every image before creating the upload session, printing the corrupt ones."""
+        report = self.image_uploader_process.verify_images()
+        corrupt_images = {
+            image: error for image, error in report.items() if error is not None
+        }
+        for image, error in corrupt_images.items():
+            print(
+                self.translation.get("image_corrupt", "{} is corrupt: {}").format(
+                    image, error
+                )
+            )
+
+        if corrupt_images:
+            print(
+                self.translation.get(
+                    "chapter_corrupt_images",
+                    "{} of {} images in {} are corrupt, skipping.",
+                ).format(len(corrupt_images), len(report), self.zip_name)
+            )
+            return False
+
+        logger.info(f"Verified the {len(report)} images of {self.zip_name}.")
+        return True
+
+    def _upload_batches(self, image_batches) -> "bool":
+        """Create the upload session, upload the image batches and commit the chapter."""
+        if not self.image_uploader_process.fits_upload_session():
+            print(
+                self.translation.get(
+                    "session_size_exceeded",
+                    "{} is {} mb, over the {} mb upload session limit, skipping.",
+                ).format(
+                    self.zip_name,
+                    round(self.image_uploader_process.source_size / 1048576, 2),
+                    round(self.image_uploader_process.max_session_size / 1048576, 2),
+                )
+            )
+            logger.error(
+                f"{self.zip_name} is {self.image_uploader_process.source_size} bytes, over the upload session limit."
+            )
+            self.failed_uploads.append(self.to_upload)
+            return False
+
+        if self.verify_images and not self._verify_images():
+            self.failed_uploads.append(self.to_upload)
+            return False
+
+        try:
+            self.image_uploader_process.check_images()
+        except MuplValidationError as e:
+            logger.error(f"Skipping {self.zip_name}: {e}")
+            self.failed_uploads.append(self.to_upload)
+            return False
+
+        first_batch = next(image_batches, None)
+        if first_batch is None:
             print(self.translation["invalid_images_to_upload"])
             logger.error(f"No valid images found for {self.zip_name}")
             self.failed_uploads.append(self.to_upload)
             return False
+        batches = itertools.chain([first_batch], image_batches)
 
         self.http_client.login()
         if not self.http_client._check_terms_accepted():
@@ -215,7 +297,6 @@ class ChapterUploader(ChapterUploaderHandler):
 
         upload_session_response_json = self._create_upload_session()
         if upload_session_response_json is None:
-            time.sleep(self.ratelimit_time)
             return False
 
         self.upload_session_id = upload_session_response_json["data"]["id"]
@@ -227,45 +308,23 @@ class ChapterUploader(ChapterUploaderHandler):
         if self.verbose:
             print(
                 self.translation["images_to_upload"].format(
-                    len(
-                        [
-                            item
-                            for sublist in self.image_uploader_process.valid_images_to_upload
-                            for item in sublist
-                        ]
-                    )
+                    len(self.image_uploader_process.images_to_process)
                 )
             )
 
-        self.tqdm = tqdm(total=len(self.image_uploader_process.info_list))
+        self.tqdm = tqdm(total=len(self.page_order))
 
         if self.threaded:
             if self.verbose:
                 print(self.translation["threaded_upload_running"])
-
-            spliced_images_list = [
-                self.image_uploader_process.valid_images_to_upload[
-                    elem : elem + self.number_threads
-                ]
-                for elem in range(
-                    0,
-                    len(self.image_uploader_process.valid_images_to_upload),
-                    self.number_threads,
-                )
-            ]
-
-            for spliced_images in spliced_images_list:
-                self.run_threaded_uploader(spliced_images)
-                if self.failed_image_upload:
-                    break
+            self.run_threaded_uploader(batches)
         else:
             if self.verbose:
                 print(self.translation["non_threaded_upload_running"])
-            self.run_image_uploader(self.image_uploader_process.valid_images_to_upload)
+            self.run_image_uploader(batches)
 
         self.tqdm.close()
-        if not self.folder_upload:
-            self.myzip.close()
+        self._close_chapter_files(image_batches)
 
         # Skip chapter upload and delete upload session
         if self.failed_image_upload:
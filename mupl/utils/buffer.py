@@ -0,0 +1,67 @@
+import io
+import os
+from typing import Optional, Union
+
+
+class BufferReader(io.RawIOBase):
+    """A read only file over a bytes-like object, without copying it.
+
+    `io.BytesIO` copies memoryviews and bytearrays it's given, so memory mapped files
+    would be read into memory whole before Pillow reads their header. Only the bytes
+    asked for are copied out of the buffer here.
+    """
+
+    def __init__(self, buffer: "Union[bytes, bytearray, memoryview]") -> None:
+        self._view = memoryview(buffer).cast("B")
+        self._position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        self._check_closed()
+        return self._position
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        self._check_closed()
+        if whence == os.SEEK_SET:
+            position = offset
+        elif whence == os.SEEK_CUR:
+            position = self._position + offset
+        elif whence == os.SEEK_END:
+            position = len(self._view) + offset
+        else:
+            raise ValueError(f"Invalid whence ({whence}).")
+
+        if position < 0:
+            raise ValueError(f"Negative seek position {position}.")
+        self._position = position
+        return position
+
+    def read(self, size: "Optional[int]" = -1) -> "bytes":
+        self._check_closed()
+        start = min(self._position, len(self._view))
+        end = len(self._view) if size is None or size < 0 else start + size
+        data = bytes(self._view[start:end])
+        self._position = start + len(data)
+        return data
+
+    def readall(self) -> "bytes":
+        return self.read()
+
+    def readinto(self, buffer) -> int:
+        data = self.read(len(memoryview(buffer).cast("B")))
+        memoryview(buffer).cast("B")[: len(data)] = data
+        return len(data)
+
+    def close(self) -> None:
+        if not self.closed:
+            self._view.release()
+        super().close()
+
+    def _check_closed(self) -> None:
+        if self.closed:
+            raise ValueError("I/O operation on closed file.")
@@ -0,0 +1,123 @@
+import hashlib
+import logging
+import os
+import struct
+import tempfile
+import threading
+from pathlib import Path
+from typing import Iterable, List, Optional
+
+logger = logging.getLogger("mupl")
+
+# Bump when the processing output changes so old entries aren't reused
+CACHE_VERSION = 1
+
+
+class PageCache:
+    """Content addressed cache of processed pages on disk.
+
+    Entries are keyed by a hash of the source images and the processing parameters.
+    The least recently used entries are deleted once the cache is over `max_size` bytes.
+    """
+
+    def __init__(self, path: "Path", max_size: int) -> None:
+        self.path = Path(path)
+        self.max_size = max(0, int(max_size))
+        self.path.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._size = sum(entry.stat().st_size for entry in self._entries())
+
+    @staticmethod
+    def make_key(sources: "Iterable[bytes]", *params) -> "str":
+        """Hash the source image data and the parameters used to process them."""
+        digest = hashlib.sha256(repr((CACHE_VERSION,) + params).encode("utf-8"))
+        for source in sources:
+            digest.update(struct.pack(">Q", len(source)))
+            digest.update(source)
+        return digest.hexdigest()
+
+    def _entries(self) -> "List[Path]":
+        return [entry for entry in self.path.glob("*/*") if entry.is_file()]
+
+    def _entry_path(self, key: "str") -> "Path":
+        return self.path.joinpath(key[:2], key)
+
+    def get(self, key: "str") -> "Optional[List[bytes]]":
+        """Return the cached pages, None if the key isn't cached."""
+        entry_path = self._entry_path(key)
+        try:
+            data = entry_path.read_bytes()
+            os.utime(entry_path)
+        except OSError:
+            return None
+
+        pages = []
+        try:
+            (count,) = struct.unpack_from(">I", data, 0)
+            offset = 4
+            for _ in range(count):
+                (length,) = struct.unpack_from(">Q", data, offset)
+                offset += 8
+                pages.append(data[offset : offset + length])
+                offset += length
+        except struct.error:
+            pages = []
+
+        if not pages or offset != len(data):
+            logger.warning(f"Removing corrupt cache entry {key}.")
+            self._remove(entry_path)
+            return None
+        return pages
+
+    def put(self, key: "str", pages: "List[bytes]") -> None:
+        """Store the pages and evict the least recently used entries if needed."""
+        data = struct.pack(">I", len(pages)) + b"".join(
+            struct.pack(">Q", len(page)) + page for page in pages
+        )
+        if len(data) > self.max_size:
+            return
+
+        entry_path = self._entry_path(key)
+        try:
+            entry_path.parent.mkdir(parents=True, exist_ok=True)
+            previous_size = entry_path.stat().st_size if entry_path.exists() else 0
+            with tempfile.NamedTemporaryFile(
+                dir=entry_path.parent, delete=False
+            ) as temp_file:
+                temp_file.write(data)
+            os.replace(temp_file.name, entry_path)
+        except OSError as e:
+            logger.warning(f"Couldn't write cache entry {key}: {e}")
+            return
+
+        with self._lock:
+            self._size += len(data) - previous_size
+        self._evict()
+
+    @staticmethod
+    def _last_used(entry_path: "Path") -> float:
+        try:
+            return entry_path.stat().st_mtime
+        except OSError:
+            return 0
+
+    def _remove(self, entry_path: "Path") -> None:
+        try:
+            size = entry_path.stat().st_size
+            entry_path.unlink()
+        except OSError:
+            return
+        with self._lock:
+            self._size -= size
+
+    def _evict(self) -> None:
+        """Delete the least recently used entries until the cache fits in `max_size`."""
+        if self._size <= self.max_size:
+            return
+
+        entries = sorted(self._entries(), key=self._last_used)
+        for entry_path in entries:
+            if self._size <= self.max_size:
+                break
+            logger.debug(f"Evicting cache entry {entry_path.name}.")
+            self._remove(entry_path)
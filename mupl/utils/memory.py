@@ -0,0 +1,43 @@
+import logging
+import threading
+
+logger = logging.getLogger("mupl")
+
+
+class MemoryBudget:
+    """Bytes of decoded image data that can be in memory at once.
+
+    Work that doesn't fit waits until enough is released. Work bigger than the whole
+    budget is let through once nothing else is using it, so it runs on its own.
+    """
+
+    def __init__(self, size: int) -> None:
+        self.size = max(1, int(size))
+        self.used = 0
+        self._condition = threading.Condition()
+
+    def _fits(self, amount: int) -> bool:
+        return self.used == 0 or self.used + amount <= self.size
+
+    def try_acquire(self, amount: int) -> bool:
+        """Reserve `amount` bytes if they fit right now."""
+        with self._condition:
+            if not self._fits(amount):
+                return False
+            self.used += amount
+            return True
+
+    def acquire(self, amount: int) -> None:
+        """Reserve `amount` bytes, waiting until they fit."""
+        with self._condition:
+            if not self._fits(amount):
+                logger.debug(
+                    f"Waiting for {amount} bytes of memory, {self.used} of {self.size} used."
+                )
+            self._condition.wait_for(lambda: self._fits(amount))
+            self.used += amount
+
+    def release(self, amount: int) -> None:
+        with self._condition:
+            self.used = max(0, self.used - amount)
+            self._condition.notify_all()
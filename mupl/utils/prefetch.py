@@ -0,0 +1,134 @@
+import logging
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional
+
+logger = logging.getLogger("mupl")
+
+
+class ChapterPrefetcher:
+    """Reads the next chapters in the background while the current one uploads.
+
+    The files are read and thrown away, which leaves them in the system's page cache,
+    so the uploader reads them from memory instead of waiting on slow or network
+    storage. At most `lookahead` chapters after the current one are read, and reading
+    stops once `max_bytes` bytes were read ahead of it.
+    """
+
+    def __init__(
+        self,
+        chapters: "List[Optional[Path]]",
+        lookahead: int = 2,
+        max_bytes: int = 512 * 1024 * 1024,
+        chunk_size: int = 1024 * 1024,
+    ) -> None:
+        self.chapters = [
+            Path(chapter) if chapter is not None else None for chapter in chapters
+        ]
+        self.lookahead = max(1, lookahead)
+        self.max_bytes = max(1, max_bytes)
+        self.chunk_size = max(1, chunk_size)
+
+        # The first chapter is read by the uploader straight away
+        self._current = 0
+        self._done: "Dict[int, int]" = {}
+        self._closed = False
+        self._condition = threading.Condition()
+        self._thread: "Optional[threading.Thread]" = None
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(
+            target=self._run, name="mupl-prefetch", daemon=True
+        )
+        self._thread.start()
+
+    def advance(self, index: int) -> None:
+        """Mark chapter `index` as uploading, reading ahead from the chapter after it.
+
+        Chapters before it were uploaded or skipped, reading them is stopped."""
+        with self._condition:
+            self._current = max(self._current, index)
+            for done_index in [i for i in self._done if i <= self._current]:
+                del self._done[done_index]
+            self._condition.notify_all()
+
+    def close(self) -> None:
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _read_ahead(self) -> int:
+        return sum(self._done.values())
+
+    def _is_wanted(self, index: int) -> bool:
+        return (
+            not self._closed
+            and self.chapters[index] is not None
+            and self._current < index <= self._current + self.lookahead
+        )
+
+    def _next_chapter(self) -> "Optional[int]":
+        """Wait for a chapter to read, None once closed."""
+        with self._condition:
+            while not self._closed:
+                if self._read_ahead() < self.max_bytes:
+                    for index in range(
+                        self._current + 1,
+                        min(len(self.chapters), self._current + self.lookahead + 1),
+                    ):
+                        if index not in self._done and self._is_wanted(index):
+                            self._done[index] = 0
+                            return index
+
+                if self._current + 1 >= len(self.chapters):
+                    return None
+                self._condition.wait()
+        return None
+
+    def _run(self) -> None:
+        buffer = bytearray(self.chunk_size)
+        while True:
+            index = self._next_chapter()
+            if index is None:
+                return
+
+            chapter = self.chapters[index]
+            if chapter.is_dir():
+                files = sorted(path for path in chapter.rglob("*") if path.is_file())
+            else:
+                files = [chapter]
+
+            try:
+                for file in files:
+                    if not self._read_file(index, file, buffer):
+                        logger.debug(f"Stopped prefetching {chapter.name}.")
+                        break
+                else:
+                    logger.debug(f"Prefetched {chapter.name}.")
+            except OSError as e:
+                logger.warning(f"Couldn't prefetch {chapter.name}: {e}")
+
+    def _read_file(self, index: int, file: "Path", buffer: "bytearray") -> bool:
+        """Read the file in chunks, False if the chapter stopped being wanted."""
+        with open(file, "rb", buffering=0) as f:
+            while True:
+                with self._condition:
+                    while (
+                        self._is_wanted(index) and self._read_ahead() >= self.max_bytes
+                    ):
+                        self._condition.wait()
+                    if not self._is_wanted(index):
+                        return False
+
+                read = f.readinto(buffer)
+                if not read:
+                    return True
+
+                with self._condition:
+                    if index in self._done:
+                        self._done[index] += read
@@ -0,0 +1,130 @@
+import logging
+import os
+import secrets
+import threading
+from multiprocessing import shared_memory
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+logger = logging.getLogger("mupl")
+
+# Windows frees shared memory when its last handle is closed, so the block would be
+# gone before the main process attaches to it
+SHARED_MEMORY_SUPPORTED = os.name != "nt"
+# Where Linux lists the shared memory blocks
+SHARED_MEMORY_DIRECTORY = Path("/dev/shm")
+
+
+class SharedPages:
+    """Pages written by a worker process into a single shared memory block.
+
+    Only the block name and the page offsets are pickled back to the main process,
+    which reads the pages as memoryviews of the block. The block is unlinked once
+    every page was released, or when `close` is called.
+    """
+
+    def __init__(self, block_name: "str", pages: "List[Tuple[str, int, int]]") -> None:
+        self.block_name = block_name
+        self.pages = pages
+        self._block: "Optional[shared_memory.SharedMemory]" = None
+        self._views: "List[memoryview]" = []
+        self._remaining = 0
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def __getstate__(self) -> dict:
+        return {"block_name": self.block_name, "pages": self.pages}
+
+    def __setstate__(self, state: dict) -> None:
+        self.__init__(state["block_name"], state["pages"])
+
+    @classmethod
+    def create(cls, pages: "List[Tuple[str, bytes]]") -> "SharedPages":
+        """Copy the pages into a new shared memory block, in the worker process."""
+        size = sum(len(page_bytes) for _, page_bytes in pages)
+        # Named after the main process, so it can find the blocks of killed workers
+        block = shared_memory.SharedMemory(
+            name=f"mupl{os.getppid()}_{secrets.token_hex(8)}",
+            create=True,
+            size=max(1, size),
+        )
+        offsets = []
+        offset = 0
+        try:
+            for page_name, page_bytes in pages:
+                block.buf[offset : offset + len(page_bytes)] = page_bytes
+                offsets.append((page_name, offset, len(page_bytes)))
+                offset += len(page_bytes)
+        except BaseException:
+            block.close()
+            block.unlink()
+            raise
+        block.close()
+        return cls(block.name, offsets)
+
+    def attach(self) -> "List[Tuple[str, memoryview]]":
+        """Open the block in the main process and return the pages without copying them."""
+        self._block = shared_memory.SharedMemory(name=self.block_name)
+        self._views = [
+            self._block.buf[offset : offset + length]
+            for _, offset, length in self.pages
+        ]
+        self._remaining = len(self.pages)
+        if not self.pages:
+            self.close()
+            return []
+        return [(page[0], view) for page, view in zip(self.pages, self._views)]
+
+    def release(self) -> None:
+        """Release one page, the block is closed after the last one."""
+        with self._lock:
+            self._remaining -= 1
+            if self._remaining > 0:
+                return
+        self.close()
+
+    def close(self) -> None:
+        """Release the pages and unlink the block, the pages can't be read after this.
+        Blocks that were never attached are opened just to unlink them."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            block, self._block = self._block, None
+            views, self._views = self._views, []
+        if block is None:
+            try:
+                block = shared_memory.SharedMemory(name=self.block_name)
+            except FileNotFoundError:
+                return
+
+        try:
+            for view in views:
+                view.release()
+            block.close()
+        except BufferError:
+            # Something still holds a page, the memory is freed when it's collected
+            logger.debug(f"Shared page block {self.block_name} is still in use.")
+        try:
+            block.unlink()
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def unlink_orphans() -> None:
+        """Unlink the blocks made by this process's workers, after the workers died.
+        Pages already attached stay readable until they're closed."""
+        if not SHARED_MEMORY_DIRECTORY.is_dir():
+            return
+
+        for path in SHARED_MEMORY_DIRECTORY.glob(f"mupl{os.getpid()}_*"):
+            try:
+                block = shared_memory.SharedMemory(name=path.name)
+            except FileNotFoundError:
+                continue
+            block.close()
+            try:
+                block.unlink()
+            except FileNotFoundError:
+                pass
+            logger.debug(f"Unlinked shared page block {path.name} of a dead worker.")
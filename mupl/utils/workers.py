@@ -0,0 +1,120 @@
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Optional
+
+from mupl.exceptions import MuplProcessingTimeoutError
+
+logger = logging.getLogger("mupl")
+
+
+class WorkerPool:
+    """Worker processes kept between chapters and replaced after a while.
+
+    The processes are restarted after `recycle_chapters` chapters or once
+    `recycle_bytes` bytes of images were sent to them, so memory fragmented by
+    decoding is given back to the system. Tasks that take longer than `timeout`
+    seconds kill the workers.
+    """
+
+    def __init__(
+        self,
+        number_processes: int,
+        initializer: "Optional[Callable]" = None,
+        initargs: tuple = (),
+        recycle_chapters: int = 50,
+        recycle_bytes: int = 4 * 1024 * 1024 * 1024,
+        timeout: "Optional[float]" = 300,
+    ) -> None:
+        self.number_processes = max(1, number_processes)
+        self.initializer = initializer
+        self.initargs = initargs
+        self.recycle_chapters = max(1, recycle_chapters)
+        self.recycle_bytes = max(1, recycle_bytes)
+        self.timeout = timeout
+
+        self._executor: "Optional[ProcessPoolExecutor]" = None
+        self._lock = threading.Lock()
+        self._chapters = 0
+        self._bytes = 0
+
+    def _get_executor(self) -> "ProcessPoolExecutor":
+        with self._lock:
+            if self._executor is None:
+                logger.debug(f"Starting {self.number_processes} worker processes.")
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.number_processes,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=self.initializer,
+                    initargs=self.initargs,
+                )
+                self._chapters = 0
+                self._bytes = 0
+            return self._executor
+
+    def submit(self, fn: "Callable", *args, size: int = 0) -> "Future":
+        """Run `fn` in a worker, `size` is counted towards recycling the workers."""
+        executor = self._get_executor()
+        try:
+            future = executor.submit(fn, *args)
+        except BrokenProcessPool:
+            self._discard(executor)
+            executor = self._get_executor()
+            future = executor.submit(fn, *args)
+
+        with self._lock:
+            self._bytes += size
+        return future
+
+    def result(self, future: "Future") -> "Any":
+        """Wait for the result of a task, killing the workers if it takes too long."""
+        try:
+            return future.result(timeout=self.timeout)
+        except FuturesTimeoutError as e:
+            logger.error(
+                f"Worker didn't finish in {self.timeout} seconds, restarting the workers."
+            )
+            self._discard(self._executor, kill=True)
+            raise MuplProcessingTimeoutError(
+                f"Processing didn't finish in {self.timeout} seconds."
+            ) from e
+        except BrokenProcessPool:
+            logger.error("A worker process died, restarting the workers.")
+            self._discard(self._executor)
+            raise
+
+    def finish_chapter(self) -> None:
+        """Count a processed chapter, restarting the workers if they are due."""
+        with self._lock:
+            self._chapters += 1
+            recycle = (
+                self._chapters >= self.recycle_chapters
+                or self._bytes >= self.recycle_bytes
+            )
+            chapters, processed_bytes = self._chapters, self._bytes
+
+        if recycle and self._executor is not None:
+            logger.info(
+                f"Restarting the worker processes after {chapters} chapters and {processed_bytes} bytes."
+            )
+            self._discard(self._executor)
+
+    def _discard(
+        self, executor: "Optional[ProcessPoolExecutor]", kill: bool = False
+    ) -> None:
+        with self._lock:
+            if executor is None or executor is not self._executor:
+                return
+            self._executor = None
+
+        if kill:
+            # Stuck workers never pick up the shutdown, so they are stopped directly
+            for process in list(getattr(executor, "_processes", {}).values()):
+                process.kill()
+        executor.shutdown(wait=not kill, cancel_futures=True)
+
+    def shutdown(self) -> None:
+        self._discard(self._executor)
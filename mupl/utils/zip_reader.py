@@ -0,0 +1,70 @@
+import collections
+import logging
+import os
+import threading
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger("mupl")
+
+
+class ParallelZipReader:
+    """Decompresses zip members on several threads at once.
+
+    zlib releases the GIL while inflating, so every thread opens its own handle to
+    the archive and members are decompressed in parallel. A `ZipFile` can't be shared
+    for this, it seeks the single underlying file for each read.
+    """
+
+    def __init__(self, path: "Path", number_threads: "Optional[int]" = None) -> None:
+        self.path = Path(path)
+        self.number_threads = max(
+            1, number_threads if number_threads is not None else os.cpu_count() or 1
+        )
+        self._local = threading.local()
+        self._handles: "List[zipfile.ZipFile]" = []
+        self._handles_lock = threading.Lock()
+
+    def _get_handle(self) -> "zipfile.ZipFile":
+        handle = getattr(self._local, "handle", None)
+        if handle is None:
+            handle = zipfile.ZipFile(self.path)
+            self._local.handle = handle
+            with self._handles_lock:
+                self._handles.append(handle)
+        return handle
+
+    def _read_member(self, name: "str") -> "bytes":
+        return self._get_handle().read(name)
+
+    def iter_members(self, names: "Iterable[str]") -> "Iterator[Tuple[str, bytes]]":
+        """Yield the name and data of each member in the order of `names`.
+
+        A few members per thread are decompressed ahead of the one being yielded,
+        errors are raised when their member is reached."""
+        max_pending = self.number_threads * 2
+        pending: "collections.deque" = collections.deque()
+        with ThreadPoolExecutor(
+            max_workers=self.number_threads, thread_name_prefix="mupl-unzip"
+        ) as executor:
+            try:
+                for name in names:
+                    pending.append((name, executor.submit(self._read_member, name)))
+                    if len(pending) >= max_pending:
+                        name, future = pending.popleft()
+                        yield name, future.result()
+
+                while pending:
+                    name, future = pending.popleft()
+                    yield name, future.result()
+            finally:
+                for _, future in pending:
+                    future.cancel()
+
+    def close(self) -> None:
+        with self._handles_lock:
+            handles, self._handles = self._handles, []
+        for handle in handles:
+            handle.close()